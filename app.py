@@ -1,34 +1,67 @@
 import os
+import gc
 from datetime import datetime
 from flask import Flask, render_template, request, jsonify, send_file
 from werkzeug.utils import secure_filename
 from document_processor import (
     add_document_to_index, 
-    search_in_index, 
+    find_document_by_hash,
+    search_documents,
     get_metadata,
     delete_document,
     get_document_content,
-    rebuild_index_with_new_config
+    model_manager,
+    preload_for_fork,
+    get_embedding_client,
+    forget_collection,
+    build_config_changed,
+    SIMILARITY_MODES
 )
+from rebuild_jobs import start_rebuild, get_rebuild_status, resume_pending_rebuilds
+from search_cache import configure_caches, get_cache_stats, search_result_cache
+from upload_stream import StreamingRequest, UploadSink, discard_incoming
 from config import load_config, save_config, get_version
+from collection_manager import (
+    DEFAULT_COLLECTION,
+    COLLECTION_CONFIG_KEYS,
+    collection_exists,
+    list_collections,
+    create_collection,
+    delete_collection,
+    load_collection_config,
+    save_collection_config,
+    get_collection_upload_dir
+)
 
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'pdf', 'docx', 'txt'}
 
 app = Flask(__name__)
+app.request_class = StreamingRequest
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = 512 * 1024 * 1024
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+configure_caches(load_config())
+
+# Under a preforking server (see gunicorn.conf.py) load models and indexes in the
+# master so workers share them copy-on-write. Interrupted rebuilds are then resumed
+# by a worker after the fork: a rebuild thread in the master could hold locks that
+# the forked workers would inherit locked.
+if os.environ.get('CSE_PRELOAD') == '1':
+    preload_for_fork()
+    gc.freeze()
+else:
+    resume_pending_rebuilds()
 
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def get_upload_path(filename):
+def get_upload_path(filename, collection=DEFAULT_COLLECTION):
     timestamp_dir = datetime.now().strftime('%Y%m%d')
-    upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], timestamp_dir)
+    upload_dir = os.path.join(get_collection_upload_dir(collection), timestamp_dir)
     os.makedirs(upload_dir, exist_ok=True)
     
     base_name = os.path.splitext(filename)[0]
@@ -39,6 +72,51 @@ def get_upload_path(filename):
     return os.path.join(upload_dir, unique_filename)
 
 
+def save_upload(file, filepath, collection=DEFAULT_COLLECTION):
+    """Move a streamed upload into place, returning its content hash and any pages
+    extracted while it arrived"""
+    sink = file.stream
+    if not isinstance(sink, UploadSink):
+        file.save(filepath)
+        return None, None
+    
+    sink.close()
+    os.replace(sink.path, filepath)
+    # Streamed chunks are only usable if they followed this collection's chunking settings
+    pages_text = sink.pages() if sink.collection == collection else None
+    return sink.hexdigest(), pages_text
+
+
+@app.teardown_request
+def remove_incoming_uploads(exc):
+    discard_incoming(getattr(request, 'upload_sinks', []))
+
+
+def get_collection_arg(data=None):
+    """Read the target collection from a JSON body, form or query string"""
+    source = data if data is not None else request.values
+    return source.get('collection') or DEFAULT_COLLECTION
+
+
+def collection_not_found(collection):
+    return jsonify({'success': False, 'error': f'Collection {collection} not found'}), 404
+
+
+def validate_search_settings(data):
+    """Check `similarity` and `min_score` in a request body, converting `min_score`
+    to a float in place. Returns an error message, or None if they are valid."""
+    if 'similarity' in data and data['similarity'] not in SIMILARITY_MODES:
+        return f"similarity must be one of {', '.join(SIMILARITY_MODES)}"
+    if data.get('min_score') is not None:
+        try:
+            data['min_score'] = float(data['min_score'])
+        except (TypeError, ValueError):
+            data['min_score'] = None
+        if data['min_score'] is None or not 0 <= data['min_score'] <= 1:
+            return "min_score must be a number between 0 and 1"
+    return None
+
+
 @app.route('/')
 def index():
     metadata = get_metadata()
@@ -57,14 +135,24 @@ def search():
     data = request.get_json()
     query = data.get('query', '').strip()
     sort_by = data.get('sort_by', 'relevance')
+    collections = data.get('collections') or [get_collection_arg(data)]
+    
+    error = validate_search_settings(data)
+    if error:
+        return jsonify({'error': error}), 400
     
     if not query:
         return jsonify({'results': [], 'query': query})
     
+    for collection in collections:
+        if not collection_exists(collection):
+            return collection_not_found(collection)
+    
     config = load_config()
     num_results = config.get('num_search_results', 5)
     
-    results = search_in_index(query, num_matches=num_results, sort_by=sort_by)
+    results = search_documents(query, collections, num_matches=num_results, sort_by=sort_by,
+                               min_score=data.get('min_score'))
     return jsonify({'results': results, 'query': query})
 
 
@@ -77,16 +165,32 @@ def upload_file():
     if not files or files[0].filename == '':
         return jsonify({'error': 'No files selected'}), 400
     
+    collection = get_collection_arg()
+    if not collection_exists(collection):
+        return collection_not_found(collection)
+    
     uploaded_files = []
+    skipped = []
     errors = []
     
     for file in files:
         if file and allowed_file(file.filename):
             original_filename = secure_filename(file.filename)
-            filepath = get_upload_path(original_filename)
-            file.save(filepath)
+            filepath = get_upload_path(original_filename, collection)
+            content_hash, pages_text = save_upload(file, filepath, collection)
+            
+            duplicate_doc = content_hash and find_document_by_hash(content_hash, collection)
+            if duplicate_doc:
+                os.remove(filepath)
+                skipped.append(
+                    f"{original_filename}: already indexed as {duplicate_doc['filename']}"
+                )
+                continue
             
-            success, message, doc_id = add_document_to_index(filepath, original_filename, original_filename)
+            success, message, doc_id = add_document_to_index(
+                filepath, original_filename, original_filename, content_hash=content_hash,
+                collection=collection, pages_text=pages_text
+            )
             if success:
                 uploaded_files.append(original_filename)
             else:
@@ -96,11 +200,12 @@ def upload_file():
         else:
             errors.append(f"{file.filename}: Invalid file type. Only PDF, DOCX, and TXT allowed.")
     
-    metadata = get_metadata()
+    metadata = get_metadata(collection)
     
     response = {
-        'success': len(uploaded_files) > 0,
+        'success': len(uploaded_files) > 0 or len(skipped) > 0,
         'uploaded': uploaded_files,
+        'skipped': skipped,
         'errors': errors,
         'metadata': metadata
     }
@@ -110,13 +215,19 @@ def upload_file():
 
 @app.route('/documents', methods=['GET'])
 def list_documents():
-    metadata = get_metadata()
+    collection = get_collection_arg()
+    if not collection_exists(collection):
+        return collection_not_found(collection)
+    metadata = get_metadata(collection)
     return jsonify(metadata)
 
 
 @app.route('/documents/<doc_id>', methods=['GET'])
 def view_document(doc_id):
-    doc_content = get_document_content(doc_id)
+    collection = get_collection_arg()
+    if not collection_exists(collection):
+        return collection_not_found(collection)
+    doc_content = get_document_content(doc_id, collection)
     if doc_content:
         return jsonify(doc_content)
     return jsonify({'error': 'Document not found'}), 404
@@ -124,16 +235,22 @@ def view_document(doc_id):
 
 @app.route('/documents/<doc_id>', methods=['DELETE'])
 def delete_doc(doc_id):
-    success, message = delete_document(doc_id)
+    collection = get_collection_arg()
+    if not collection_exists(collection):
+        return collection_not_found(collection)
+    success, message = delete_document(doc_id, collection)
     if success:
-        metadata = get_metadata()
+        metadata = get_metadata(collection)
         return jsonify({'success': True, 'message': message, 'metadata': metadata})
     return jsonify({'success': False, 'error': message}), 404
 
 
 @app.route('/config', methods=['GET'])
 def get_config():
-    config = load_config()
+    collection = get_collection_arg()
+    if not collection_exists(collection):
+        return collection_not_found(collection)
+    config = load_collection_config(collection)
     return jsonify(config)
 
 
@@ -141,21 +258,61 @@ def get_config():
 def update_config():
     data = request.get_json()
     
+    error = validate_search_settings(data)
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+    
+    collection = get_collection_arg(data)
+    if collection != DEFAULT_COLLECTION:
+        return update_collection_config(collection, data)
+    
     current_config = load_config()
     current_model = current_config.get('model_repo_id')
+    current_similarity = current_config.get('similarity')
     
     # Update config
-    for key in ['model_repo_id', 'chunk_size', 'chunk_overlap', 'num_search_results', 'top_k', 'dimension']:
+    for key in ['model_repo_id', 'chunk_size', 'chunk_overlap', 'num_search_results', 'top_k',
+                'dimension', 'near_duplicate_threshold', 'query_embedding_cache_size',
+                'search_cache_size', 'search_cache_ttl', 'model_memory_budget_mb', 'similarity',
+                'min_score']:
         if key in data:
             current_config[key] = data[key]
     
     save_config(current_config)
+    configure_caches(current_config)
+    model_manager.configure(current_config.get('model_memory_budget_mb', 2048))
+    search_result_cache.clear()
     
-    # If model changed, offer to rebuild index
+    # If model changed, offer to rebuild index; the live index keeps its build settings until then
     new_model = current_config.get('model_repo_id')
     needs_rebuild = (current_model != new_model) or \
-                   (data.get('chunk_size') and data.get('chunk_size') != current_config.get('chunk_size')) or \
-                   (data.get('chunk_overlap') and data.get('chunk_overlap') != current_config.get('chunk_overlap'))
+                   (current_similarity != current_config.get('similarity')) or \
+                   (data.get('chunk_size') and
+                    data.get('chunk_size') != current_config.get('chunk_size')) or \
+                   (data.get('chunk_overlap') and
+                    data.get('chunk_overlap') != current_config.get('chunk_overlap')) or \
+                   build_config_changed(collection)
+    
+    return jsonify({
+        'success': True,
+        'config': current_config,
+        'needs_rebuild': needs_rebuild
+    })
+
+
+def update_collection_config(collection, data):
+    if not collection_exists(collection):
+        return collection_not_found(collection)
+    
+    previous_config = load_collection_config(collection)
+    save_collection_config(collection, data)
+    current_config = load_collection_config(collection)
+    search_result_cache.clear()
+    
+    needs_rebuild = any(
+        previous_config.get(key) != current_config.get(key)
+        for key in ['model_repo_id', 'chunk_size', 'chunk_overlap', 'dimension', 'similarity']
+    ) or build_config_changed(collection)
     
     return jsonify({
         'success': True,
@@ -164,26 +321,96 @@ def update_config():
     })
 
 
+@app.route('/collections', methods=['GET'])
+def get_collections():
+    collections = []
+    for name in list_collections():
+        config = load_collection_config(name)
+        metadata = get_metadata(name)
+        collections.append({
+            'name': name,
+            'config': {key: config.get(key) for key in COLLECTION_CONFIG_KEYS},
+            'documents': len(metadata.get('documents', [])),
+            'total_chunks': metadata.get('total_chunks', 0)
+        })
+    return jsonify({'collections': collections})
+
+
+@app.route('/collections', methods=['POST'])
+def add_collection():
+    data = request.get_json()
+    name = data.get('name', '')
+    config = data.get('config', {})
+    error = validate_search_settings(config)
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+    success, message = create_collection(name, config)
+    if success:
+        return jsonify({
+            'success': True,
+            'message': message,
+            'config': load_collection_config(name)
+        }), 201
+    return jsonify({'success': False, 'error': message}), 400
+
+
+@app.route('/collections/<name>', methods=['DELETE'])
+def remove_collection(name):
+    success, message = delete_collection(name)
+    if success:
+        forget_collection(name)
+        return jsonify({'success': True, 'message': message})
+    return jsonify({'success': False, 'error': message}), 400 if collection_exists(name) else 404
+
+
 @app.route('/rebuild-index', methods=['POST'])
 def rebuild_index():
-    try:
-        success, message = rebuild_index_with_new_config()
-        if success:
-            metadata = get_metadata()
-            return jsonify({
-                'success': True,
-                'message': message,
-                'metadata': metadata
-            })
-        else:
-            return jsonify({'success': False, 'error': message}), 500
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    collection = get_collection_arg(request.get_json(silent=True) or {})
+    if not collection_exists(collection):
+        return collection_not_found(collection)
+    
+    started, job = start_rebuild(collection)
+    if started:
+        return jsonify({'success': True, 'message': 'Rebuild started', 'job': job}), 202
+    return jsonify({'success': False, 'error': 'A rebuild is already running', 'job': job}), 409
+
+
+@app.route('/rebuild-index/status', methods=['GET'])
+def rebuild_status():
+    collection = get_collection_arg()
+    if not collection_exists(collection):
+        return collection_not_found(collection)
+    
+    job = get_rebuild_status(collection)
+    if job is None:
+        return jsonify({'error': 'No rebuild has been started'}), 404
+    return jsonify({'job': job, 'metadata': get_metadata(collection)})
+
+
+@app.route('/models', methods=['GET'])
+def loaded_models():
+    return jsonify(model_manager.stats())
+
+
+@app.route('/embedding-worker/stats', methods=['GET'])
+def embedding_worker_stats():
+    client = get_embedding_client()
+    if client is None:
+        return jsonify({'error': 'No embedding worker is configured'}), 404
+    return jsonify(client.stats())
+
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(get_cache_stats())
 
 
 @app.route('/metadata', methods=['GET'])
 def metadata():
-    return jsonify(get_metadata())
+    collection = get_collection_arg()
+    if not collection_exists(collection):
+        return collection_not_found(collection)
+    return jsonify(get_metadata(collection))
 
 
 if __name__ == '__main__':
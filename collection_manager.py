@@ -0,0 +1,198 @@
+import os
+import re
+import json
+import fcntl
+import shutil
+import threading
+from config import load_config
+
+COLLECTIONS_DIR = "collections"
+DEFAULT_COLLECTION = "default"
+COLLECTION_CONFIG_FILE = "config.json"
+UPLOAD_BASE_DIR = "uploads"
+
+INDEX_FILENAME = "faiss_index.idx"
+CHUNK_MAPPING_FILENAME = "index_to_chunk.pkl"
+METADATA_FILENAME = "document_metadata.pkl"
+REBUILD_CHECKPOINT_FILENAME = "rebuild_checkpoint.pkl"
+REBUILD_CHECKPOINT_INDEX_FILENAME = "rebuild_checkpoint.idx"
+REBUILD_LOCK_FILENAME = "rebuild.lock"
+REBUILD_STATUS_FILENAME = "rebuild_status.json"
+WRITE_LOCK_FILENAME = "write.lock"
+BULK_MANIFEST_FILENAME = "bulk_manifest.pkl"
+
+# Settings that define how a collection's shard is built; everything else stays global
+COLLECTION_CONFIG_KEYS = ["model_repo_id", "chunk_size", "chunk_overlap", "dimension",
+                          "near_duplicate_threshold", "similarity", "min_score"]
+
+_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# One write lock per collection so writes never block other collections
+_write_locks = {}
+_write_locks_guard = threading.Lock()
+
+
+def is_valid_collection_name(name):
+    """Collection names double as directory names"""
+    return bool(name) and bool(_NAME_PATTERN.match(name))
+
+
+def get_collection_dir(name):
+    """The default collection lives in the working directory for backward compatibility"""
+    if name == DEFAULT_COLLECTION:
+        return ""
+    return os.path.join(COLLECTIONS_DIR, name)
+
+
+def get_collection_paths(name):
+    """Get index, chunk store and metadata paths of a collection"""
+    collection_dir = get_collection_dir(name)
+    return {
+        "index": os.path.join(collection_dir, INDEX_FILENAME),
+        "chunks": os.path.join(collection_dir, CHUNK_MAPPING_FILENAME),
+        "metadata": os.path.join(collection_dir, METADATA_FILENAME),
+        "rebuild_checkpoint": os.path.join(collection_dir, REBUILD_CHECKPOINT_FILENAME),
+        "rebuild_checkpoint_index": os.path.join(collection_dir, REBUILD_CHECKPOINT_INDEX_FILENAME),
+        "rebuild_lock": os.path.join(collection_dir, REBUILD_LOCK_FILENAME),
+        "rebuild_status": os.path.join(collection_dir, REBUILD_STATUS_FILENAME),
+        "write_lock": os.path.join(collection_dir, WRITE_LOCK_FILENAME),
+        "bulk_manifest": os.path.join(collection_dir, BULK_MANIFEST_FILENAME)
+    }
+
+
+def get_generation_paths(name, generation):
+    """Get paths of one index generation; generation 0 is the original unversioned file pair"""
+    paths = get_collection_paths(name)
+    if generation:
+        for key in ("index", "chunks"):
+            base, ext = os.path.splitext(paths[key])
+            paths[key] = f"{base}.{generation}{ext}"
+    return paths
+
+
+def get_collection_upload_dir(name):
+    """Uploaded files are kept inside their collection so they go away with it"""
+    if name == DEFAULT_COLLECTION:
+        return UPLOAD_BASE_DIR
+    return os.path.join(get_collection_dir(name), UPLOAD_BASE_DIR)
+
+
+def collection_exists(name):
+    if name == DEFAULT_COLLECTION:
+        return True
+    return is_valid_collection_name(name) and os.path.isdir(get_collection_dir(name))
+
+
+def list_collections():
+    """List collection names, default first"""
+    names = [DEFAULT_COLLECTION]
+    if os.path.isdir(COLLECTIONS_DIR):
+        names += sorted(
+            name for name in os.listdir(COLLECTIONS_DIR)
+            if name != DEFAULT_COLLECTION and os.path.isdir(os.path.join(COLLECTIONS_DIR, name))
+        )
+    return names
+
+
+def load_collection_config(name):
+    """Global configuration with the collection's overrides applied"""
+    config = load_config()
+    if name == DEFAULT_COLLECTION:
+        return config
+
+    config_path = os.path.join(get_collection_dir(name), COLLECTION_CONFIG_FILE)
+    if os.path.exists(config_path):
+        try:
+            with open(config_path, 'r') as f:
+                overrides = json.load(f)
+            config.update({
+                key: overrides[key] for key in COLLECTION_CONFIG_KEYS if key in overrides
+            })
+        except Exception as e:
+            print(f"Error reading config of collection {name}: {e}")
+    return config
+
+
+def save_collection_config(name, overrides):
+    """Persist a collection's config overrides"""
+    config_path = os.path.join(get_collection_dir(name), COLLECTION_CONFIG_FILE)
+    current = {}
+    if os.path.exists(config_path):
+        with open(config_path, 'r') as f:
+            current = json.load(f)
+    current.update({key: overrides[key] for key in COLLECTION_CONFIG_KEYS if key in overrides})
+    with open(config_path, 'w') as f:
+        json.dump(current, f, indent=2)
+    return current
+
+
+def create_collection(name, overrides=None):
+    """Create an empty collection with its own config.
+
+    The current global settings are copied in full, so later changes to the
+    global config do not alter how the collection is indexed or searched.
+    """
+    if not is_valid_collection_name(name):
+        return False, "Collection names may only contain letters, digits, '-' and '_'"
+    if collection_exists(name):
+        return False, f"Collection {name} already exists"
+
+    config = load_config()
+    config.update(overrides or {})
+    os.makedirs(get_collection_dir(name))
+    save_collection_config(name, config)
+    return True, f"Created collection {name}"
+
+
+def delete_collection(name):
+    """Delete a collection and its shard"""
+    if name == DEFAULT_COLLECTION:
+        return False, "The default collection cannot be deleted"
+    if not collection_exists(name):
+        return False, "Collection not found"
+
+    with get_write_lock(name):
+        shutil.rmtree(get_collection_dir(name))
+    return True, f"Deleted collection {name}"
+
+
+class CollectionWriteLock:
+    """Serializes writes to one collection between threads and between processes.
+
+    Threads of a process queue on a thread lock; the holder then takes an
+    fcntl.flock on the collection's lock file, which orders it against
+    other processes such as the bulk loader and other app workers.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._thread_lock = threading.Lock()
+        self._lock_file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            self._lock_file = open(get_collection_paths(self.name)["write_lock"], "a")
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        except Exception:
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+        self._lock_file = None
+        self._thread_lock.release()
+        return False
+
+
+def get_write_lock(name):
+    """Get the lock serializing writes to one collection"""
+    with _write_locks_guard:
+        if name not in _write_locks:
+            _write_locks[name] = CollectionWriteLock(name)
+        return _write_locks[name]
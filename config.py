@@ -10,7 +10,15 @@ DEFAULT_CONFIG = {
     "chunk_overlap": 50,
     "num_search_results": 5,
     "top_k": 10,
-    "dimension": 768
+    "dimension": 768,
+    "near_duplicate_threshold": 1.0,
+    "query_embedding_cache_size": 1024,
+    "search_cache_size": 512,
+    "search_cache_ttl": 300,
+    "model_memory_budget_mb": 2048,
+    "embedding_worker_socket": "",
+    "similarity": "cosine",
+    "min_score": 0.0
 }
 
 
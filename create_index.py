@@ -1,150 +1,314 @@
 import os
+import time
 import pickle
+import argparse
+import multiprocessing
 
-import faiss
-import numpy as np
-
-from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
 import torch
-from transformers import DistilBertTokenizer, DistilBertModel
 
+from dedup import hash_file, NearDuplicateIndex
+from collection_manager import (
+    DEFAULT_COLLECTION,
+    collection_exists,
+    get_collection_paths,
+    get_write_lock
+)
+import document_processor
 
-# GLOBAL CONSTANTS
-MODEL_PATH = 'distilbert-base-uncased'
-DIMENSION = 768
-NLIST = 2
-INDEX_PATH = "faiss_index.idx"
-CHUNK_MAPPING_PATH = "index_to_chunk.pkl"
-MAX_CHUNK_SIZE = 64
 
+# GLOBAL CONSTANTS
+SUPPORTED_EXTENSIONS = {".pdf", ".docx", ".txt"}
+CHECKPOINT_INTERVAL = 60
+EMBEDDING_BATCH_SIZE = 32
 
-# Initialization of model
-TOKENIZER = DistilBertTokenizer.from_pretrained(MODEL_PATH)
-MODEL = DistilBertModel.from_pretrained(MODEL_PATH)
+# Per-process configuration of pool workers
+_worker_config = None
 
 
-def get_embedding(text, pooling='mean'):
+def find_documents(folder_path):
     """
-    Compute the embeddings for a given text using DistilBert.
-    
+    Walk a directory tree and collect the documents that can be indexed.
+
     Parameters:
-    - text (str): The text for which embeddings are to be generated.
-    - pooling (str, optional): The type of pooling to be applied. 
-                               Can be 'mean', 'max', or 'mean_max'. 
-                               Defaults to 'mean'.
-                               
+    - folder_path (str): Root of the directory tree to scan.
+
     Returns:
-    - numpy.ndarray: The computed embedding.
-    
-    Pooling Techniques Explained:
-    --------------------------------
-    Pooling is a technique to aggregate a sequence of embeddings into a single embedding vector. 
-    Given a text with N tokens, we get an NxD matrix of embeddings (D is the embedding dimension). 
-    To transform this into a 1xD embedding, we use pooling. Here's how each technique works:
-
-    - Mean Pooling:
-        We take the average of all embeddings in the sequence.
-        Example: For embeddings [2, 4, 6] and [3, 6, 9], mean pooling results in [2.5, 5, 7.5].
-
-    - Max Pooling:
-        We take the maximum value in each dimension across all embeddings in the sequence.
-        Example: For embeddings [2, 4, 6] and [3, 6, 9], max pooling results in [3, 6, 9].
-
-    - Min Pooling:
-        We take the minimum value in each dimension across all embeddings in the sequence.
-        Example: For embeddings [2, 4, 6] and [3, 6, 9], min pooling results in [2, 4, 6].
-    
+    - list: Absolute paths of PDF, DOCX and TXT files, in a stable order.
+
     Example:
-    >>> embedding = get_embedding("Hello, world!")
-    >>> print(embedding.shape)
-    (1, 768)
+    >>> find_documents('./docs/')
+    ['/home/me/docs/a.pdf', '/home/me/docs/reports/b.docx']
     """
-    input_ids = TOKENIZER.encode(text, return_tensors="pt", truncation=True)
-    with torch.no_grad():
-        output = MODEL(input_ids)
-    if pooling == 'mean':
-        return output.last_hidden_state.mean(dim=1).numpy()
-    elif pooling == 'max':
-        return output.last_hidden_state.max(dim=1).numpy()
-    elif pooling == 'mean_max':
-        mean_pooled = output.last_hidden_state.mean(dim=1).numpy()
-        max_pooled = output.last_hidden_state.max(dim=1).numpy()
-        return np.concatenate([mean_pooled, max_pooled], axis=1)
-
-
-def chunk_document(document, max_size=MAX_CHUNK_SIZE):
+    paths = []
+    for root, dirs, files in os.walk(folder_path):
+        dirs.sort()
+        for filename in sorted(files):
+            if os.path.splitext(filename)[1].lower() in SUPPORTED_EXTENSIONS:
+                paths.append(os.path.abspath(os.path.join(root, filename)))
+    return paths
+
+
+def load_manifest(collection):
     """
-    Split the document into smaller chunks of maximum size.
-    
+    Load the record of files indexed by previous bulk runs.
+
     Parameters:
-    - document (str): The text document to be split.
-    - max_size (int, optional): The maximum number of words per chunk. 
-                                Defaults to MAX_CHUNK_SIZE.
-                                
-    Yields:
-    - str: Chunks of the document.
-    
-    Example:
-    >>> chunks = list(chunk_document("This is a sample document with more than eight words."))
-    >>> for chunk in chunks:
-    ...     print(chunk)
-    ...
-    This is a sample document with more
-    than eight words.
+    - collection (str): Collection the files were indexed into.
+
+    Returns:
+    - dict: Maps each file path to its `mtime`, `size`, `hash` and `doc_id`.
     """
-    words = document.split()
-    for i in range(0, len(words), max_size):
-        yield ' '.join(words[i:i+max_size])
+    manifest_path = get_collection_paths(collection)["bulk_manifest"]
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "rb") as f:
+            return pickle.load(f)
+    return {}
 
 
-def preprocess_text(text):
-    return ' '.join([word for word in text.lower().split() if word not in ENGLISH_STOP_WORDS])
+def save_manifest(collection, manifest):
+    manifest_path = get_collection_paths(collection)["bulk_manifest"]
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
 
 
-def create_faiss_index(folder_path):
+def plan_files(paths, manifest, documents_by_hash):
     """
-    Create and save a FAISS index for all the documents in the provided folder.
-    
+    Decide which files need indexing, skipping those unchanged since the last run.
+
+    A file whose size and mtime match its manifest entry is skipped without
+    being read. Otherwise it is hashed: unchanged content only refreshes the
+    manifest entry, and content that is already indexed under another path
+    is recorded against the existing document. Files with identical content
+    thus share one document, which is only replaced once no other file still
+    points at it and it was not uploaded through the app.
+
     Parameters:
-    - folder_path (str): Path to the folder containing the .txt documents.
-    
-    Writes:
-    - An index file (faiss_index.idx) and a mapping file (index_to_chunk.pkl) to disk.
-    
+    - paths (list): Candidate file paths.
+    - manifest (dict): Manifest from previous runs; updated in place.
+    - documents_by_hash (dict): Indexed documents keyed by content hash.
+
+    Returns:
+    - list: (path, content_hash, stale_doc_id) for each file to index, where
+            stale_doc_id is the document of an earlier version to replace.
+    """
+    pending = []
+    for path in paths:
+        stat = os.stat(path)
+        entry = manifest.get(path)
+        if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            continue
+
+        content_hash = hash_file(path)
+        if entry and entry["hash"] == content_hash:
+            entry.update(mtime=stat.st_mtime, size=stat.st_size)
+            continue
+
+        existing = documents_by_hash.get(content_hash)
+        if existing:
+            manifest[path] = {"mtime": stat.st_mtime, "size": stat.st_size,
+                              "hash": content_hash, "doc_id": existing["id"]}
+            continue
+
+        pending.append((path, content_hash, entry["doc_id"] if entry else None))
+
+    # Keep documents still used by files that are not being reindexed
+    reindexed = {path for path, content_hash, stale_doc_id in pending}
+    in_use = {entry["doc_id"] for path, entry in manifest.items() if path not in reindexed}
+    replaceable = {doc["id"] for doc in documents_by_hash.values() if doc.get("external")} - in_use
+    return [
+        (path, content_hash, stale_doc_id if stale_doc_id in replaceable else None)
+        for path, content_hash, stale_doc_id in pending
+    ]
+
+
+def _init_worker(config, workers):
+    """Load the embedding model once per worker process"""
+    global _worker_config
+    _worker_config = config
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    document_processor.get_model_and_tokenizer(config.get("model_repo_id"))
+
+
+def _extract_and_embed(path):
+    """
+    Extract, chunk and embed one file inside a worker process.
+
+    Returns:
+    - tuple: (path, pages_text, vectors), where vectors holds one embedding per
+             chunk in chunking order, or None if no text could be extracted.
+    """
+    config = _worker_config
+    pages_text = document_processor.extract_text_from_file(path)
+    chunks = [
+        chunk
+        for page_data in pages_text
+        for chunk in document_processor.chunk_text(
+            page_data['text'], config.get("chunk_size", 500), config.get("chunk_overlap", 50)
+        )
+    ]
+    if not chunks:
+        return path, pages_text, None
+
+    vectors = document_processor.get_embeddings(
+        chunks, config.get("model_repo_id"), EMBEDDING_BATCH_SIZE
+    )
+    return path, pages_text, vectors
+
+
+def _commit_files(collection, config, finished, manifest, stale_doc_ids=()):
+    """
+    Merge finished files into the live shard of a collection as a new generation.
+
+    Runs under the collection's write lock and reloads the live shard first,
+    so uploads, deletes and rebuilds made by the app in the meantime are kept.
+
+    Parameters:
+    - collection (str): Target collection.
+    - config (dict): Collection configuration.
+    - finished (list): (path, pages_text, vectors, content_hash) per extracted file.
+    - manifest (dict): Bulk manifest; updated in place and saved.
+    - stale_doc_ids (iterable, optional): Documents of earlier file versions to drop.
+
+    Returns:
+    - tuple: (indexed, skipped, failed) file counts and the chunk count of the collection.
+    """
+    indexed = skipped = failed = 0
+    with get_write_lock(collection):
+        index, index_to_chunk, metadata = document_processor.initialize_or_load_index(collection)
+
+        # Drop earlier versions of changed files before indexing the new content
+        live_ids = {doc["id"] for doc in metadata["documents"]}
+        for doc_id in stale_doc_ids:
+            if doc_id in live_ids:
+                index, index_to_chunk = document_processor.remove_document_chunks(
+                    index, index_to_chunk, doc_id
+                )
+                metadata["documents"] = [
+                    doc for doc in metadata["documents"] if doc["id"] != doc_id
+                ]
+                metadata["total_chunks"] = len(index_to_chunk)
+        document_processor.update_chunk_counts(metadata, index_to_chunk)
+
+        documents_by_hash = {doc.get("content_hash"): doc for doc in metadata["documents"]}
+        near_duplicates = NearDuplicateIndex.from_chunks(
+            index_to_chunk, config.get("near_duplicate_threshold", 1.0)
+        )
+
+        for path, pages_text, vectors, content_hash in finished:
+            doc_metadata = None
+            if vectors is not None and content_hash not in documents_by_hash:
+                doc_metadata = document_processor.index_document(
+                    path, os.path.basename(path), pages_text, content_hash, config,
+                    index, index_to_chunk, metadata, near_duplicates, vectors=vectors, external=True
+                )
+
+            if doc_metadata:
+                documents_by_hash[content_hash] = doc_metadata
+                indexed += 1
+            elif content_hash in documents_by_hash:
+                doc_metadata = documents_by_hash[content_hash]
+                skipped += 1
+            else:
+                print(f"Could not extract text from {path}")
+                failed += 1
+
+            stat = os.stat(path)
+            manifest[path] = {"mtime": stat.st_mtime, "size": stat.st_size, "hash": content_hash,
+                              "doc_id": doc_metadata["id"] if doc_metadata else None}
+
+        document_processor.save_index(collection, index, index_to_chunk, metadata)
+        save_manifest(collection, manifest)
+    return indexed, skipped, failed, len(index_to_chunk)
+
+
+def bulk_index(folder_path, collection=DEFAULT_COLLECTION, workers=None):
+    """
+    Index a directory tree of PDF, DOCX and TXT files into a collection.
+
+    Files are extracted and embedded by a pool of worker processes. Every
+    CHECKPOINT_INTERVAL seconds the main process takes the collection's
+    write lock, which the web app's writes also take, and merges the
+    finished files into the live shard as a new index generation together
+    with a manifest of finished files. The app can keep uploading and
+    deleting while a bulk run is in progress; an interrupted run resumes
+    where it stopped and later runs only index files that are new or
+    changed. Documents are indexed in place and their files are not touched
+    when they are deleted from the app.
+
+    Parameters:
+    - folder_path (str): Root of the directory tree to index.
+    - collection (str, optional): Target collection. Defaults to 'default'.
+    - workers (int, optional): Number of worker processes. Defaults to the CPU count.
+
+    Returns:
+    - tuple: (indexed, skipped, failed) file counts.
+
     Example:
-    >>> create_faiss_index('./docs/')
-    >>> # This will generate 'faiss_index.idx' and 'index_to_chunk.pkl'
+    >>> bulk_index('./archive/', workers=4)
+    (1250, 0, 3)
     """
+    config = document_processor.get_build_config(collection)
+    workers = workers or os.cpu_count() or 1
+
+    metadata = document_processor.get_metadata(collection)
+    manifest = load_manifest(collection)
+
+    paths = find_documents(folder_path)
+    documents_by_hash = {doc.get("content_hash"): doc for doc in metadata["documents"]}
+    pending = plan_files(paths, manifest, documents_by_hash)
+    skipped = len(paths) - len(pending)
+    print(f"Found {len(paths)} files, {len(pending)} to index, {skipped} unchanged")
+
+    if not pending:
+        save_manifest(collection, manifest)
+        return 0, skipped, 0
+
+    pending_by_path = {path: content_hash for path, content_hash, stale_doc_id in pending}
+    stale_doc_ids = {stale_doc_id for path, content_hash, stale_doc_id in pending if stale_doc_id}
+
+    indexed = failed = 0
+    finished = []
+    started = last_checkpoint = time.time()
+    context = multiprocessing.get_context("spawn")
+
+    with context.Pool(workers, initializer=_init_worker, initargs=(config, workers)) as pool:
+        for path, pages_text, vectors in pool.imap_unordered(_extract_and_embed, pending_by_path):
+            finished.append((path, pages_text, vectors, pending_by_path[path]))
+
+            if time.time() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                counts = _commit_files(collection, config, finished, manifest, stale_doc_ids)
+                indexed, skipped = indexed + counts[0], skipped + counts[1]
+                failed += counts[2]
+                finished, stale_doc_ids = [], set()
+                last_checkpoint = time.time()
+                done = indexed + failed
+                rate = done / (last_checkpoint - started)
+                print(f"Checkpoint: {done}/{len(pending_by_path)} files ({rate:.1f} files/s)")
+
+    counts = _commit_files(collection, config, finished, manifest, stale_doc_ids)
+    indexed, skipped, failed = indexed + counts[0], skipped + counts[1], failed + counts[2]
+    elapsed = time.time() - started
+    print(f"Indexed {indexed} files ({counts[3]} chunks in collection) in {elapsed:.1f}s")
+    return indexed, skipped, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bulk-index a directory tree of PDF, DOCX and TXT files."
+    )
+    parser.add_argument("folder", help="Directory to scan recursively")
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION, help="Collection to index into")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    if not collection_exists(args.collection):
+        parser.error(f"Collection {args.collection} does not exist")
 
-    index_to_chunk = {}
-
-    quantizer = faiss.IndexHNSWFlat(DIMENSION, 32)
-    index = faiss.IndexIVFFlat(quantizer, DIMENSION, NLIST, faiss.METRIC_L2)
-    
-    all_embeddings = []
-    all_chunks = []
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".txt"):
-            with open(os.path.join(folder_path, filename), 'r', encoding="utf-8") as f:
-                content = preprocess_text(f.read())
-                for chunk in chunk_document(content):
-                    embedding = get_embedding(chunk)
-                    all_embeddings.append(embedding)
-                    all_chunks.append(chunk)
-                    
-    embeddings_np = np.vstack(all_embeddings)
-    faiss.normalize_L2(embeddings_np)
-    index.train(embeddings_np)
-    
-    for i, embedding in enumerate(all_embeddings):
-        index.add(embedding)
-        index_to_chunk[i] = all_chunks[i]
-    
-    faiss.write_index(index, INDEX_PATH)
-    with open(CHUNK_MAPPING_PATH, "wb") as f:
-        pickle.dump(index_to_chunk, f)
+    bulk_index(args.folder, args.collection, args.workers)
 
 
 if __name__ == "__main__":
-    folder_path = './docs/'
-    create_faiss_index(folder_path)
+    main()
@@ -0,0 +1,106 @@
+import hashlib
+import numpy as np
+
+NUM_PERMUTATIONS = 64
+NUM_BANDS = 16
+SHINGLE_SIZE = 3
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Universal hashing modulo a Mersenne prime keeps every product inside uint64
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, (1 << 31) - 1, size=NUM_PERMUTATIONS).astype(np.uint64)
+_PERM_B = _rng.randint(0, (1 << 31) - 1, size=NUM_PERMUTATIONS).astype(np.uint64)
+
+
+def hash_file(file_path):
+    """Compute SHA-256 of a file without loading it into memory"""
+    hasher = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def _shingle_hashes(text):
+    """Hash overlapping word shingles of normalized text to 32-bit integers"""
+    words = text.lower().split()
+    if len(words) < SHINGLE_SIZE:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {
+            " ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)
+        }
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+         for s in shingles],
+        dtype=np.uint64
+    )
+
+
+def minhash_signature(text):
+    """Compute the MinHash signature of a chunk of text"""
+    hashes = _shingle_hashes(text) % _MERSENNE_PRIME
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _MERSENNE_PRIME
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def estimate_similarity(sig_a, sig_b):
+    """Estimate Jaccard similarity from two MinHash signatures"""
+    return float(np.mean(sig_a == sig_b))
+
+
+class NearDuplicateIndex:
+    """LSH index over MinHash signatures of the chunks already stored.
+
+    A threshold of 1.0 (the default) only matches chunks with identical text:
+    a chunk that is merely similar may differ in the one clause a search is
+    looking for, so it is indexed on its own. Lower thresholds opt in to
+    referencing near-duplicates by estimated Jaccard similarity.
+    """
+
+    def __init__(self, threshold=1.0):
+        self.threshold = threshold
+        self.rows = NUM_PERMUTATIONS // NUM_BANDS
+        self.buckets = {}
+        self.signatures = {}
+        self.texts = {}
+
+    @classmethod
+    def from_chunks(cls, index_to_chunk, threshold=1.0):
+        lsh = cls(threshold)
+        for idx, chunk_data in index_to_chunk.items():
+            signature = chunk_data.get("minhash")
+            if signature is not None:
+                lsh.add(idx, signature, chunk_data.get("text"))
+        return lsh
+
+    def _band_keys(self, signature):
+        for band in range(NUM_BANDS):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, idx, signature, text=None):
+        self.signatures[idx] = signature
+        self.texts[idx] = text
+        for key in self._band_keys(signature):
+            self.buckets.setdefault(key, []).append(idx)
+
+    def find(self, signature, text=None):
+        """Return (idx, similarity) of the closest stored chunk above threshold, or None"""
+        exact = self.threshold >= 1.0
+        best = None
+        seen = set()
+        for key in self._band_keys(signature):
+            for idx in self.buckets.get(key, ()):
+                if idx in seen:
+                    continue
+                seen.add(idx)
+                if exact:
+                    # Equal signatures do not imply equal text, so compare the text itself
+                    if text is not None and self.texts[idx] == text:
+                        return idx, 1.0
+                    continue
+                similarity = estimate_similarity(signature, self.signatures[idx])
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (idx, similarity)
+        return best
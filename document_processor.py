@@ -1,22 +1,67 @@
 import os
+import time
 import pickle
 import faiss
 import numpy as np
 import torch
 from datetime import datetime
-from transformers import AutoTokenizer, AutoModel
+from concurrent.futures import ThreadPoolExecutor
 from PyPDF2 import PdfReader
 from docx import Document as DocxDocument
 from config import load_config
+from model_manager import ModelManager
+from embedding_worker import (
+    EmbeddingClient,
+    EmbeddingWorkerUnavailable,
+    INTERACTIVE_LANE,
+    BULK_LANE
+)
+from dedup import hash_file, minhash_signature, NearDuplicateIndex
+from search_cache import (
+    query_embedding_cache,
+    search_result_cache,
+    normalize_query,
+    invalidate_collection
+)
+from collection_manager import (
+    DEFAULT_COLLECTION,
+    get_collection_paths,
+    get_generation_paths,
+    load_collection_config,
+    get_write_lock,
+    list_collections
+)
 
-INDEX_PATH = "faiss_index.idx"
-CHUNK_MAPPING_PATH = "index_to_chunk.pkl"
-METADATA_PATH = "document_metadata.pkl"
-UPLOAD_BASE_DIR = "uploads"
+SEARCH_WORKERS = 8
+REBUILD_CHECKPOINT_INTERVAL = 30
+GENERATION_LOAD_RETRIES = 3
 
-# Global model cache
-_model_cache = {}
-_tokenizer_cache = {}
+# Settings an index generation is built with. Searches and uploads keep using those of the
+# live generation until a rebuild swaps in one built with the configured settings; a rebuild
+# checkpoint taken with different ones starts over.
+BUILD_CONFIG_KEYS = ["model_repo_id", "chunk_size", "chunk_overlap", "dimension",
+                     "near_duplicate_threshold", "similarity"]
+
+# Index similarity modes: cosine searches normalized vectors by inner product
+SIMILARITY_MODES = ["cosine", "l2"]
+
+# Shared pool for fanning searches out over collection shards
+_search_pool = ThreadPoolExecutor(max_workers=SEARCH_WORKERS)
+
+# Faiss flags for read-only, memory-mapped loading of the flat vector codes
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+# Metadata file signature and generation last seen per collection
+_generation_memo = {}
+
+# Live shard per collection for searches: (index version, index, index_to_chunk, metadata)
+_live_shards = {}
+
+# Loaded models, bounded by the configured memory budget
+model_manager = ModelManager(load_config().get("model_memory_budget_mb", 2048))
+
+# Client for out-of-process embedding workers, created when a socket is configured
+_embedding_client = None
 
 
 def get_model_and_tokenizer(model_name=None):
@@ -25,23 +70,12 @@ def get_model_and_tokenizer(model_name=None):
         config = load_config()
         model_name = config.get("model_repo_id", "distilbert-base-uncased")
     
-    if model_name not in _model_cache:
-        try:
-            _tokenizer_cache[model_name] = AutoTokenizer.from_pretrained(model_name)
-            _model_cache[model_name] = AutoModel.from_pretrained(model_name)
-        except Exception as e:
-            print(f"Error loading model {model_name}: {e}")
-            # Fallback to default
-            model_name = "distilbert-base-uncased"
-            _tokenizer_cache[model_name] = AutoTokenizer.from_pretrained(model_name)
-            _model_cache[model_name] = AutoModel.from_pretrained(model_name)
-    
-    return _tokenizer_cache[model_name], _model_cache[model_name]
+    return model_manager.get(model_name)
 
 
-def get_embedding(text, pooling='mean'):
-    """Generate embeddings using configured model"""
-    tokenizer, model = get_model_and_tokenizer()
+def compute_embedding(text, pooling='mean', model_name=None):
+    """Generate embeddings using configured model in this process"""
+    tokenizer, model = get_model_and_tokenizer(model_name)
     
     input_ids = tokenizer.encode(text, return_tensors="pt", truncation=True, max_length=512)
     with torch.no_grad():
@@ -55,6 +89,82 @@ def get_embedding(text, pooling='mean'):
     return output.last_hidden_state.mean(dim=1).numpy()
 
 
+def get_embedding_client():
+    """Client for the configured embedding workers, or None to embed in-process"""
+    global _embedding_client
+    sockets = os.environ.get("CSE_EMBEDDING_SOCKET") or \
+        load_config().get("embedding_worker_socket", "")
+    if not sockets:
+        return None
+    if _embedding_client is None or _embedding_client.socket_paths != sockets.split(","):
+        _embedding_client = EmbeddingClient(sockets)
+    return _embedding_client
+
+
+def get_embedding(text, pooling='mean', model_name=None, lane=INTERACTIVE_LANE):
+    """Generate embeddings using configured model, in the embedding worker when one is configured
+    
+    `lane` is the worker priority lane: searches use the interactive lane and
+    ingestion the bulk lane, so queries are not stuck behind large uploads.
+    """
+    client = get_embedding_client()
+    if client is not None:
+        if model_name is None:
+            model_name = load_config().get("model_repo_id", "distilbert-base-uncased")
+        try:
+            return client.embed([text], model_name, lane, pooling)
+        except EmbeddingWorkerUnavailable as e:
+            print(f"Embedding in-process: {e}")
+    
+    return compute_embedding(text, pooling, model_name)
+
+
+def embed_chunks(texts, model_name=None):
+    """Embed a document's chunks in one bulk-lane request, or in batches in-process"""
+    client = get_embedding_client()
+    if client is not None:
+        if model_name is None:
+            model_name = load_config().get("model_repo_id", "distilbert-base-uncased")
+        try:
+            return client.embed(texts, model_name, BULK_LANE)
+        except EmbeddingWorkerUnavailable as e:
+            print(f"Embedding in-process: {e}")
+    
+    return get_embeddings(texts, model_name)
+
+
+def get_query_embedding(query, model_name=None):
+    """Embed a search query, reusing the embedding of a repeated query"""
+    if model_name is None:
+        model_name = load_config().get("model_repo_id", "distilbert-base-uncased")
+    
+    key = (model_name, query)
+    vector = query_embedding_cache.get(key)
+    if vector is None:
+        vector = get_embedding(query, model_name=model_name)
+        query_embedding_cache.put(key, vector)
+    return vector
+
+
+def get_embeddings(texts, model_name=None, batch_size=32):
+    """Embed texts in padded batches; masked mean pooling matches get_embedding"""
+    tokenizer, model = get_model_and_tokenizer(model_name)
+    
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        batch = tokenizer(texts[start:start + batch_size], return_tensors="pt",
+                          truncation=True, max_length=512, padding=True)
+        with torch.no_grad():
+            output = model(**batch)
+        mask = batch["attention_mask"].unsqueeze(-1).to(output.last_hidden_state.dtype)
+        pooled = (output.last_hidden_state * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+        vectors.append(pooled.numpy())
+    
+    if not vectors:
+        return np.zeros((0, model.config.hidden_size), dtype='float32')
+    return np.vstack(vectors).astype('float32')
+
+
 def extract_text_from_pdf(file_path):
     """Extract text from PDF with page tracking"""
     pages_text = []
@@ -118,74 +228,340 @@ def chunk_text(text, chunk_size=500, overlap=50):
     return chunks
 
 
-def initialize_or_load_index():
+def create_index(dimension, similarity="cosine"):
+    """Create an empty flat index for a similarity mode"""
+    if similarity == "cosine":
+        return faiss.IndexFlatIP(dimension)
+    return faiss.IndexFlatL2(dimension)
+
+
+def index_similarity(index):
+    """Similarity mode an index was created with"""
+    return "cosine" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+
+
+def prepare_vectors(vectors, similarity):
+    """Copy vectors as float32 rows, normalized to unit length for cosine similarity"""
+    vectors = np.array(vectors, dtype='float32').reshape(-1, np.shape(vectors)[-1])
+    if similarity == "cosine":
+        faiss.normalize_L2(vectors)
+    return vectors
+
+
+def calibrate_score(raw_score, similarity):
+    """Map a raw faiss score onto 0..1, where higher is more similar.
+    
+    Cosine similarity is shifted from -1..1; squared L2 distance maps to 1 / (1 + d).
+    """
+    if similarity == "cosine":
+        return min(max((raw_score + 1) / 2, 0.0), 1.0)
+    return 1 / (1 + max(raw_score, 0.0))
+
+
+def load_index_generation(collection=DEFAULT_COLLECTION, mmap=False):
+    """Load the live index generation of a collection.
+    
+    Returns (index, index_to_chunk, metadata); index and mapping are None when
+    nothing has been indexed yet. The metadata file names the live generation,
+    so a swap that lands while loading is retried against the new generation.
+    A memory-mapped index is read-only and shared with forked processes.
+    """
+    for attempt in range(GENERATION_LOAD_RETRIES):
+        metadata = get_metadata(collection)
+        paths = get_generation_paths(collection, metadata.get("generation", 0))
+        if not os.path.exists(paths["index"]) or not os.path.exists(paths["chunks"]):
+            if metadata.get("generation", 0) == get_metadata(collection).get("generation", 0):
+                return None, None, metadata
+            continue
+        try:
+            if mmap:
+                index = faiss.read_index(paths["index"], MMAP_FLAGS)
+            else:
+                index = faiss.read_index(paths["index"])
+            with open(paths["chunks"], "rb") as f:
+                index_to_chunk = pickle.load(f)
+            return index, index_to_chunk, metadata
+        except (RuntimeError, OSError):
+            if attempt == GENERATION_LOAD_RETRIES - 1:
+                raise
+    return None, None, get_metadata(collection)
+
+
+def get_live_shard(collection=DEFAULT_COLLECTION):
+    """Get the live generation for searching, loaded once per index version and shared read-only"""
+    version = get_index_version(collection)
+    shard = _live_shards.get(collection)
+    if shard is None or shard[0] != version:
+        index, index_to_chunk, metadata = load_index_generation(collection, mmap=True)
+        shard = (version, index, index_to_chunk, metadata)
+        _live_shards[collection] = shard
+    return shard[1], shard[2], shard[3]
+
+
+def forget_collection(collection):
+    """Drop the loaded shard and memos of a deleted collection"""
+    _live_shards.pop(collection, None)
+    _generation_memo.pop(get_collection_paths(collection)["metadata"], None)
+    invalidate_collection(collection)
+
+
+def preload_for_fork(collections=None):
+    """Load models and memory-mapped indexes before a server forks its workers.
+    
+    Workers then share the model weights and index pages with the master
+    copy-on-write instead of each loading a private copy.
+    """
+    collections = collections or list_collections()
+    model_manager.preload(sorted({get_build_config(c).get("model_repo_id") for c in collections}))
+    for collection in collections:
+        get_live_shard(collection)
+
+
+def initialize_or_load_index(collection=DEFAULT_COLLECTION):
     """Initialize or load existing FAISS index"""
-    config = load_config()
-    dimension = config.get("dimension", 768)
-    
-    if os.path.exists(INDEX_PATH) and os.path.exists(CHUNK_MAPPING_PATH):
-        index = faiss.read_index(INDEX_PATH)
-        with open(CHUNK_MAPPING_PATH, "rb") as f:
-            index_to_chunk = pickle.load(f)
-        if os.path.exists(METADATA_PATH):
-            with open(METADATA_PATH, "rb") as f:
-                metadata = pickle.load(f)
-        else:
-            metadata = {"documents": [], "total_chunks": 0}
-    else:
-        index = faiss.IndexFlatL2(dimension)
+    index, index_to_chunk, metadata = load_index_generation(collection)
+    if index is None or (index.ntotal == 0 and not metadata.get("documents")):
+        # An empty collection starts over with the configured settings; once it
+        # holds documents, changing model, dimension or similarity takes a rebuild
+        config = load_collection_config(collection)
+        index = create_index(config.get("dimension", 768), config.get("similarity", "cosine"))
         index_to_chunk = {}
-        metadata = {"documents": [], "total_chunks": 0}
+        metadata["build"] = {key: config.get(key) for key in BUILD_CONFIG_KEYS}
     
     return index, index_to_chunk, metadata
 
 
-def add_document_to_index(file_path, filename, original_filename):
-    """Add document to index with enhanced metadata"""
-    config = load_config()
+def get_build_config(collection=DEFAULT_COLLECTION, metadata=None):
+    """Collection config with the build settings of the live generation applied.
+    
+    Model, dimension, chunking and similarity come from the generation being
+    served, so a config change only takes effect when a rebuild swaps in a
+    generation built with it. An empty collection follows the config.
+    """
+    config = load_collection_config(collection)
+    if metadata is None:
+        metadata = get_metadata(collection)
+    if metadata.get("documents"):
+        config.update(metadata.get("build", {}))
+    return config
+
+
+def build_config_changed(collection=DEFAULT_COLLECTION):
+    """Whether the configured build settings differ from those of the live generation"""
+    metadata = get_metadata(collection)
+    if not metadata.get("documents") or "build" not in metadata:
+        return False
+    config = load_collection_config(collection)
+    return any(config.get(key) != metadata["build"].get(key) for key in BUILD_CONFIG_KEYS)
+
+
+def _write_atomic(path, write):
+    """Write a file beside its destination and rename it into place"""
+    tmp_path = path + ".tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def save_index(collection, index, index_to_chunk, metadata):
+    """Persist a collection's shard as a new generation and swap it in.
+    
+    Index and chunk files of the new generation are written first; replacing
+    the metadata file then switches readers over in one atomic rename. The
+    previous generation is kept for readers that are still loading it.
+    """
+    generation = get_metadata(collection).get("generation", 0) + 1
+    paths = get_generation_paths(collection, generation)
+    _write_atomic(paths["index"], lambda path: faiss.write_index(index, path))
+    _write_atomic(paths["chunks"], lambda path: _dump_pickle(index_to_chunk, path))
+    
+    metadata["generation"] = generation
+    metadata["similarity"] = index_similarity(index)
+    if "build" not in metadata:
+        # Generations saved before build settings were recorded were built with the config
+        config = load_collection_config(collection)
+        metadata["build"] = {key: config.get(key) for key in BUILD_CONFIG_KEYS}
+    metadata["build"].update(dimension=index.d, similarity=metadata["similarity"])
+    _write_atomic(paths["metadata"], lambda path: _dump_pickle(metadata, path))
+    invalidate_collection(collection)
+    
+    if generation >= 2:
+        stale_paths = get_generation_paths(collection, generation - 2)
+        for key in ("index", "chunks"):
+            if os.path.exists(stale_paths[key]):
+                os.remove(stale_paths[key])
+
+
+def get_index_version(collection=DEFAULT_COLLECTION):
+    """Identify the live index of a collection by generation and metadata file signature.
+    
+    Generations restart at 1 when a collection is deleted and recreated, so
+    the signature (inode, mtime, size) tells the two apart. The metadata file
+    is re-read only when its signature changes.
+    """
+    metadata_path = get_collection_paths(collection)["metadata"]
+    try:
+        stat = os.stat(metadata_path)
+    except FileNotFoundError:
+        return 0, None
+    
+    signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    memo = _generation_memo.get(metadata_path)
+    if memo and memo[0] == signature:
+        return memo[1], signature
+    
+    generation = get_metadata(collection).get("generation", 0)
+    _generation_memo[metadata_path] = (signature, generation)
+    return generation, signature
+
+
+def get_generation(collection=DEFAULT_COLLECTION):
+    """Live index generation of a collection"""
+    return get_index_version(collection)[0]
+
+
+def _dump_pickle(obj, path):
+    with open(path, "wb") as f:
+        pickle.dump(obj, f)
+
+
+def find_document_by_hash(content_hash, collection=DEFAULT_COLLECTION):
+    """Return metadata of an indexed document with the given content hash"""
+    for doc in get_metadata(collection).get("documents", []):
+        if doc.get("content_hash") == content_hash:
+            return doc
+    return None
+
+
+def _append_document_chunks(pages_text, doc_id, document_name, config, index_to_chunk,
+                            near_duplicates, embeddings, vectors=None):
+    """Chunk pages into the mapping, referencing near-duplicate chunks instead of re-embedding them.
+    
+    `vectors` may hold precomputed embeddings, one per chunk in chunking order.
+    """
     chunk_size = config.get("chunk_size", 500)
     overlap = config.get("chunk_overlap", 50)
-    
-    pages_text = extract_text_from_file(file_path)
-    if not pages_text:
-        return False, "Could not extract text from document", None
-    
-    index, index_to_chunk, metadata = initialize_or_load_index()
-    
-    start_idx = len(index_to_chunk)
-    embeddings = []
-    
-    timestamp = datetime.now()
-    doc_id = f"doc_{timestamp.strftime('%Y%m%d_%H%M%S')}_{len(metadata['documents'])}"
+    dedupe = bool(config.get("near_duplicate_threshold"))
     
     chunk_counter = 0
+    duplicate_counter = 0
+    # Chunks still to embed, with their slot in `embeddings`
+    pending = []
     
-    # Process each page
     for page_data in pages_text:
         page_num = page_data['page_number']
-        page_text = page_data['text']
         
-        # Chunk the page text
-        page_chunks = chunk_text(page_text, chunk_size, overlap)
+        page_chunks = page_data.get('chunks')
+        if page_chunks is None:
+            page_chunks = chunk_text(page_data['text'], chunk_size, overlap)
         
         for chunk in page_chunks:
-            embedding = get_embedding(chunk)
-            embeddings.append(embedding)
-            
-            index_to_chunk[start_idx + chunk_counter] = {
-                "text": chunk,
-                "document": original_filename,
+            chunk_ref = {
+                "document": document_name,
                 "doc_id": doc_id,
                 "chunk_index": chunk_counter,
                 "page_number": page_num
             }
+            vector = vectors[chunk_counter:chunk_counter + 1] if vectors is not None else None
             chunk_counter += 1
+            
+            signature = minhash_signature(chunk) if dedupe else None
+            match = near_duplicates.find(signature, chunk) if dedupe else None
+            if match:
+                index_to_chunk[match[0]].setdefault("duplicates", []).append(chunk_ref)
+                duplicate_counter += 1
+                continue
+            
+            idx = len(index_to_chunk)
+            if vector is None:
+                pending.append((len(embeddings), chunk))
+            embeddings.append(vector)
+            index_to_chunk[idx] = dict(chunk_ref, text=chunk, minhash=signature)
+            if dedupe:
+                near_duplicates.add(idx, signature, chunk)
+    
+    if pending:
+        pending_vectors = embed_chunks([chunk for _, chunk in pending], config.get("model_repo_id"))
+        for row, (slot, _) in enumerate(pending):
+            embeddings[slot] = pending_vectors[row:row + 1]
+    
+    return chunk_counter, duplicate_counter
+
+
+def add_document_to_index(file_path, filename, original_filename, content_hash=None,
+                          collection=DEFAULT_COLLECTION, pages_text=None):
+    """Add document to index with enhanced metadata.
+    
+    `pages_text` may carry pages already extracted (and chunked) while the
+    file was uploaded, which skips reading it back from disk.
+    """
+    with get_write_lock(collection):
+        return _add_document_to_index(
+            file_path, original_filename, content_hash, collection, pages_text
+        )
+
+
+def _add_document_to_index(file_path, original_filename, content_hash, collection, pages_text):
+    if content_hash is None:
+        content_hash = hash_file(file_path)
+    duplicate_doc = find_document_by_hash(content_hash, collection)
+    if duplicate_doc:
+        message = f"Duplicate of already indexed document {duplicate_doc['filename']}"
+        return False, message, duplicate_doc["id"]
+    
+    if pages_text is None:
+        pages_text = extract_text_from_file(file_path)
+    if not pages_text:
+        return False, "Could not extract text from document", None
     
-    if len(embeddings) == 0:
+    index, index_to_chunk, metadata = initialize_or_load_index(collection)
+    config = get_build_config(collection, metadata)
+    near_duplicates = NearDuplicateIndex.from_chunks(
+        index_to_chunk, config.get("near_duplicate_threshold", 1.0)
+    )
+    
+    doc_metadata = index_document(
+        file_path, original_filename, pages_text, content_hash, config,
+        index, index_to_chunk, metadata, near_duplicates
+    )
+    if doc_metadata is None:
         return False, "No content to index", None
     
-    embeddings_array = np.vstack(embeddings).astype('float32')
-    index.add(embeddings_array)
+    save_index(collection, index, index_to_chunk, metadata)
+    
+    message = f"Successfully indexed {doc_metadata['chunks']} chunks from {original_filename}"
+    if doc_metadata["duplicate_chunks"]:
+        message += f" ({doc_metadata['duplicate_chunks']} near-duplicate chunks referenced)"
+    return True, message, doc_metadata["id"]
+
+
+def index_document(file_path, original_filename, pages_text, content_hash, config,
+                   index, index_to_chunk, metadata, near_duplicates, vectors=None, external=False):
+    """Append a document to an in-memory shard, returning its metadata or None if it has no content.
+    
+    External documents are indexed in place (e.g. by the bulk loader) and
+    their files are left alone when the document is deleted.
+    """
+    embeddings = []
+    
+    timestamp = datetime.now()
+    # Document ids identify segments in snapshots, so never reuse one freed by a delete
+    existing_ids = {doc["id"] for doc in metadata["documents"]}
+    sequence = len(metadata['documents'])
+    doc_id = f"doc_{timestamp.strftime('%Y%m%d_%H%M%S')}_{sequence}"
+    while doc_id in existing_ids:
+        sequence += 1
+        doc_id = f"doc_{timestamp.strftime('%Y%m%d_%H%M%S')}_{sequence}"
+    
+    chunk_counter, duplicate_counter = _append_document_chunks(
+        pages_text, doc_id, original_filename, config, index_to_chunk, near_duplicates,
+        embeddings, vectors
+    )
+    
+    if chunk_counter == 0:
+        return None
+    
+    if embeddings:
+        index.add(prepare_vectors(np.vstack(embeddings), index_similarity(index)))
     
     file_ext = os.path.splitext(original_filename)[1].lower()
     doc_type = "PDF" if file_ext == ".pdf" else "Word" if file_ext == ".docx" else "Text"
@@ -195,35 +571,34 @@ def add_document_to_index(file_path, filename, original_filename):
         "filename": original_filename,
         "path": file_path,
         "chunks": chunk_counter,
+        "duplicate_chunks": duplicate_counter,
+        "content_hash": content_hash,
         "uploaded_on": timestamp.isoformat(),
         "type": doc_type,
         "size": os.path.getsize(file_path),
-        "pages": len(pages_text)
+        "pages": len(pages_text),
+        "external": external,
+        # save_index swaps in the next generation, which is where this segment first appears
+        "indexed_generation": metadata.get("generation", 0) + 1
     }
     
     metadata["documents"].append(doc_metadata)
     metadata["total_chunks"] = len(index_to_chunk)
     
-    # Save
-    faiss.write_index(index, INDEX_PATH)
-    with open(CHUNK_MAPPING_PATH, "wb") as f:
-        pickle.dump(index_to_chunk, f)
-    with open(METADATA_PATH, "wb") as f:
-        pickle.dump(metadata, f)
-    
-    return True, f"Successfully indexed {chunk_counter} chunks from {original_filename}", doc_id
+    return doc_metadata
 
 
-def delete_document(doc_id):
+def delete_document(doc_id, collection=DEFAULT_COLLECTION):
     """Delete document and rebuild index"""
-    config = load_config()
-    dimension = config.get("dimension", 768)
-    
-    if not os.path.exists(INDEX_PATH) or not os.path.exists(CHUNK_MAPPING_PATH):
+    with get_write_lock(collection):
+        return _delete_document(doc_id, collection)
+
+
+def _delete_document(doc_id, collection):
+    index, index_to_chunk, metadata = load_index_generation(collection)
+    if index is None:
         return False, "No index found"
     
-    index, index_to_chunk, metadata = initialize_or_load_index()
-    
     doc_to_delete = None
     for doc in metadata["documents"]:
         if doc["id"] == doc_id:
@@ -233,43 +608,70 @@ def delete_document(doc_id):
     if not doc_to_delete:
         return False, "Document not found"
     
-    new_index = faiss.IndexFlatL2(dimension)
-    new_index_to_chunk = {}
-    new_idx = 0
-    embeddings_to_keep = []
-    
-    for idx, chunk_data in index_to_chunk.items():
-        if chunk_data.get("doc_id") != doc_id:
-            new_index_to_chunk[new_idx] = chunk_data
-            vector = get_embedding(chunk_data["text"])
-            embeddings_to_keep.append(vector)
-            new_idx += 1
-    
-    if embeddings_to_keep:
-        embeddings_array = np.vstack(embeddings_to_keep).astype('float32')
-        new_index.add(embeddings_array)
+    new_index, new_index_to_chunk = remove_document_chunks(index, index_to_chunk, doc_id)
     
     metadata["documents"] = [doc for doc in metadata["documents"] if doc["id"] != doc_id]
     metadata["total_chunks"] = len(new_index_to_chunk)
+    update_chunk_counts(metadata, new_index_to_chunk)
     
-    if os.path.exists(doc_to_delete["path"]):
+    if not doc_to_delete.get("external") and os.path.exists(doc_to_delete["path"]):
         try:
             os.remove(doc_to_delete["path"])
         except:
             pass
     
-    faiss.write_index(new_index, INDEX_PATH)
-    with open(CHUNK_MAPPING_PATH, "wb") as f:
-        pickle.dump(new_index_to_chunk, f)
-    with open(METADATA_PATH, "wb") as f:
-        pickle.dump(metadata, f)
+    save_index(collection, new_index, new_index_to_chunk, metadata)
     
     return True, f"Successfully deleted {doc_to_delete['filename']}"
 
 
-def get_document_content(doc_id):
+def remove_document_chunks(index, index_to_chunk, doc_id):
+    """Drop a document's chunks, keeping chunks it shares with other documents"""
+    new_index = create_index(index.d, index_similarity(index))
+    new_index_to_chunk = {}
+    new_idx = 0
+    rows_to_keep = []
+    
+    for idx, chunk_data in index_to_chunk.items():
+        duplicates = [ref for ref in chunk_data.get("duplicates", []) if ref["doc_id"] != doc_id]
+        if chunk_data.get("doc_id") == doc_id:
+            if not duplicates:
+                continue
+            # Promote the first remaining reference to own the shared chunk
+            chunk_data = dict(chunk_data, **duplicates.pop(0))
+        chunk_data["duplicates"] = duplicates
+        new_index_to_chunk[new_idx] = chunk_data
+        rows_to_keep.append(idx)
+        new_idx += 1
+    
+    # Reuse stored vectors instead of re-embedding the surviving chunks
+    if rows_to_keep:
+        vectors = index.reconstruct_n(0, index.ntotal)
+        new_index.add(vectors[rows_to_keep].astype('float32'))
+    
+    return new_index, new_index_to_chunk
+
+
+def update_chunk_counts(metadata, index_to_chunk):
+    """Recount each document's chunks and referenced duplicates.
+
+    Needed whenever chunks change owner, e.g. after a delete promoted references.
+    """
+    counts = {}
+    for chunk_data in index_to_chunk.values():
+        counts.setdefault(chunk_data.get("doc_id"), [0, 0])[0] += 1
+        for ref in chunk_data.get("duplicates", []):
+            ref_counts = counts.setdefault(ref["doc_id"], [0, 0])
+            ref_counts[0] += 1
+            ref_counts[1] += 1
+    
+    for doc in metadata["documents"]:
+        doc["chunks"], doc["duplicate_chunks"] = counts.get(doc["id"], (0, 0))
+
+
+def get_document_content(doc_id, collection=DEFAULT_COLLECTION):
     """Get full document content"""
-    metadata = get_metadata()
+    metadata = get_metadata(collection)
     for doc in metadata["documents"]:
         if doc["id"] == doc_id:
             if os.path.exists(doc["path"]):
@@ -284,122 +686,305 @@ def get_document_content(doc_id):
     return None
 
 
-def search_in_index(query, num_matches=5, sort_by="relevance"):
-    """Search index with sorting options"""
-    if not os.path.exists(INDEX_PATH) or not os.path.exists(CHUNK_MAPPING_PATH):
-        return []
-    
+def search_in_index(query, num_matches=5, sort_by="relevance", collection=DEFAULT_COLLECTION,
+                    query_vector=None, min_score=None, score_as=None):
+    """Search index with sorting options.
+    
+    `score` is calibrated to 0..1 (higher is better) and `raw_score` is the
+    faiss inner product or squared L2 distance. Hits come back best first, so
+    the first hit below `min_score` ends the scan. `score_as="cosine"` scores
+    the hits of an L2 index by cosine similarity instead, to put them on the
+    same scale as cosine shards.
+    """
     if not query or not query.strip():
         return []
     
-    index = faiss.read_index(INDEX_PATH)
-    with open(CHUNK_MAPPING_PATH, "rb") as f:
-        index_to_chunk = pickle.load(f)
-    
-    if len(index_to_chunk) == 0:
+    index, index_to_chunk, metadata = get_live_shard(collection)
+    if index is None or len(index_to_chunk) == 0:
         return []
     
-    config = load_config()
+    config = get_build_config(collection, metadata)
     top_k = config.get("top_k", 10)
-    
-    vector = get_embedding(query)
-    D, I = index.search(vector.reshape(1, -1), min(top_k, len(index_to_chunk)))
+    if min_score is None:
+        min_score = config.get("min_score", 0.0)
+    similarity = index_similarity(index)
+    
+    vector = query_vector
+    if vector is None:
+        vector = get_query_embedding(query, config.get("model_repo_id"))
+    D, I = index.search(prepare_vectors(vector, similarity), min(top_k, len(index_to_chunk)))
+    
+    hits = [
+        (calibrate_score(float(raw_score), similarity), float(raw_score), int(idx))
+        for raw_score, idx in zip(D[0], I[0]) if 0 <= idx < len(index_to_chunk)
+    ]
+    if score_as == "cosine" and similarity == "l2" and hits:
+        hits = _cosine_rescore(index, vector, hits)
+        similarity = "cosine"
     
     results = []
-    metadata = get_metadata()
+    upload_dates = None
     
-    for i, idx in enumerate(I[0]):
-        if idx < len(index_to_chunk):
-            chunk_data = index_to_chunk[idx]
-            
-            # Find document upload date
-            upload_date = None
-            for doc in metadata.get("documents", []):
-                if doc["id"] == chunk_data.get("doc_id"):
-                    upload_date = doc.get("uploaded_on")
-                    break
-            
-            results.append({
-                "text": chunk_data["text"],
-                "document": chunk_data.get("document", "Unknown"),
-                "doc_id": chunk_data.get("doc_id"),
-                "page_number": chunk_data.get("page_number", 1),
-                "chunk_number": chunk_data.get("chunk_index", 0) + 1,
-                "score": float(D[0][i]),
-                "uploaded_on": upload_date
-            })
+    for score, raw_score, idx in hits:
+        if score < min_score:
+            break
+        chunk_data = index_to_chunk[idx]
+        
+        # Find document upload date
+        if upload_dates is None:
+            upload_dates = {
+                doc["id"]: doc.get("uploaded_on") for doc in metadata.get("documents", [])
+            }
+        
+        results.append({
+            "text": chunk_data["text"],
+            "document": chunk_data.get("document", "Unknown"),
+            "doc_id": chunk_data.get("doc_id"),
+            "collection": collection,
+            "page_number": chunk_data.get("page_number", 1),
+            "chunk_number": chunk_data.get("chunk_index", 0) + 1,
+            "score": score,
+            "raw_score": raw_score,
+            "similarity": similarity,
+            "uploaded_on": upload_dates.get(chunk_data.get("doc_id")),
+            "also_in": sorted({ref["document"] for ref in chunk_data.get("duplicates", [])
+                               if ref["doc_id"] != chunk_data.get("doc_id")})
+        })
     
     # Sort results
     if sort_by == "recent":
-        results.sort(key=lambda x: x.get("uploaded_on", ""), reverse=True)
+        results.sort(key=lambda x: x.get("uploaded_on") or "", reverse=True)
     # Default is by relevance (already sorted by FAISS)
     
     return results[:num_matches]
 
 
-def get_metadata():
+def _cosine_rescore(index, query_vector, hits):
+    """Score L2 hits by the cosine similarity of their stored vectors, best first"""
+    query = prepare_vectors(query_vector, "cosine")[0]
+    vectors = prepare_vectors(np.vstack([index.reconstruct(idx) for _, _, idx in hits]), "cosine")
+    rescored = [
+        (calibrate_score(float(cosine), "cosine"), raw_score, idx)
+        for cosine, (_, raw_score, idx) in zip(vectors @ query, hits)
+    ]
+    return sorted(rescored, key=lambda hit: hit[0], reverse=True)
+
+
+def search_collections(query, collections, num_matches=5, sort_by="relevance", min_score=None):
+    """Search several collection shards in parallel and merge their top results.
+    
+    Calibrated L2 and cosine scores are on different scales, so when the
+    collections mix similarity modes the L2 hits are scored by cosine as
+    well before merging. Scores are only comparable between collections
+    embedded with the same model.
+    """
+    if not query or not query.strip():
+        return []
+    
+    # Embed once per model up front rather than once per shard
+    models = {
+        collection: get_build_config(collection, get_live_shard(collection)[2]).get("model_repo_id")
+        for collection in collections
+    }
+    query_vectors = {}
+    for model_name in models.values():
+        if model_name not in query_vectors:
+            query_vectors[model_name] = get_query_embedding(query, model_name)
+    
+    modes = {get_live_shard(collection)[2].get("similarity", "l2") for collection in collections}
+    score_as = "cosine" if len(modes) > 1 else None
+    
+    futures = [
+        _search_pool.submit(
+            search_in_index, query, num_matches, "relevance", collection,
+            query_vectors[models[collection]], min_score, score_as
+        )
+        for collection in collections
+    ]
+    results = [result for future in futures for result in future.result()]
+    
+    results.sort(key=lambda x: x["score"], reverse=True)
+    results = results[:num_matches]
+    if sort_by == "recent":
+        results.sort(key=lambda x: x.get("uploaded_on") or "", reverse=True)
+    
+    return results
+
+
+def _search_settings(collection):
+    """Config values that shape a collection's search results"""
+    config = get_build_config(collection, get_live_shard(collection)[2])
+    return config.get("model_repo_id"), config.get("top_k", 10), config.get("min_score", 0.0)
+
+
+def search_documents(query, collections=None, num_matches=5, sort_by="relevance", min_score=None):
+    """Search one or more collections, serving repeated searches from the result cache.
+    
+    Cached results are keyed by the live index version and the search
+    settings of every collection searched, so uploads, deletes, rebuilds and
+    config changes made by any process make stale entries unreachable.
+    """
+    collections = collections or [DEFAULT_COLLECTION]
+    if not query or not query.strip():
+        return []
+    
+    key = (
+        normalize_query(query),
+        tuple((collection, get_index_version(collection), _search_settings(collection))
+              for collection in collections),
+        sort_by,
+        num_matches,
+        min_score
+    )
+    results = search_result_cache.get(key)
+    if results is None:
+        if len(collections) == 1:
+            results = search_in_index(
+                query, num_matches, sort_by, collections[0], min_score=min_score
+            )
+        else:
+            results = search_collections(query, collections, num_matches, sort_by, min_score)
+        search_result_cache.put(key, results)
+    return results
+
+
+def get_metadata(collection=DEFAULT_COLLECTION):
     """Get document metadata"""
-    if os.path.exists(METADATA_PATH):
-        with open(METADATA_PATH, "rb") as f:
+    metadata_path = get_collection_paths(collection)["metadata"]
+    if os.path.exists(metadata_path):
+        with open(metadata_path, "rb") as f:
             return pickle.load(f)
     return {"documents": [], "total_chunks": 0}
 
 
-def rebuild_index_with_new_config():
-    """Rebuild entire index with new configuration (for model changes)"""
-    metadata = get_metadata()
-    config = load_config()
-    dimension = config.get("dimension", 768)
+def rebuild_index_with_new_config(collection=DEFAULT_COLLECTION, progress=None):
+    """Rebuild entire index with new configuration (for model changes).
     
-    if len(metadata.get("documents", [])) == 0:
-        return True, "No documents to reindex"
+    The new index is built beside the live generation, which keeps serving
+    searches and accepting uploads until the finished index is swapped in.
+    Progress is checkpointed so an interrupted rebuild resumes where it stopped.
+    """
+    config = load_collection_config(collection)
+    rebuild_config = {key: config.get(key) for key in BUILD_CONFIG_KEYS}
     
-    # Create new index
-    new_index = faiss.IndexFlatL2(dimension)
-    new_index_to_chunk = {}
-    chunk_counter = 0
-    embeddings = []
+    if len(get_metadata(collection).get("documents", [])) == 0:
+        return True, "No documents to reindex"
     
-    for doc in metadata["documents"]:
-        if not os.path.exists(doc["path"]):
+    # Documents are re-embedded from their source files; those imported from a
+    # snapshot live on the exporting node, so rebuilding would drop them
+    missing = [
+        doc["filename"] for doc in get_metadata(collection)["documents"]
+        if not os.path.exists(doc["path"])
+    ]
+    if missing:
+        return False, (f"Cannot rebuild: source files of {len(missing)} documents are missing "
+                       f"(e.g. {missing[0]}); import a snapshot built with the new settings "
+                       f"instead")
+    
+    new_index, new_index_to_chunk, done = _load_rebuild_checkpoint(collection, rebuild_config)
+    near_duplicates = NearDuplicateIndex.from_chunks(
+        new_index_to_chunk, config.get("near_duplicate_threshold", 1.0)
+    )
+    
+    documents = get_metadata(collection)["documents"]
+    total_bytes = sum(doc.get("size", 0) for doc in documents)
+    processed_bytes = sum(doc.get("size", 0) for doc in documents if doc["id"] in done)
+    last_checkpoint = time.time()
+    
+    for doc in documents:
+        if doc["id"] in done:
             continue
         
-        pages_text = extract_text_from_file(doc["path"])
+        _rebuild_document(doc, config, new_index, new_index_to_chunk, near_duplicates, done)
+        processed_bytes += doc.get("size", 0)
+        if progress:
+            progress(len(done), len(documents), processed_bytes, total_bytes)
         
-        for page_data in pages_text:
-            page_num = page_data['page_number']
-            page_text = page_data['text']
-            
-            page_chunks = chunk_text(
-                page_text,
-                config.get("chunk_size", 500),
-                config.get("chunk_overlap", 50)
+        if time.time() - last_checkpoint >= REBUILD_CHECKPOINT_INTERVAL:
+            _save_rebuild_checkpoint(
+                collection, rebuild_config, new_index, new_index_to_chunk, done
             )
-            
-            for idx, chunk in enumerate(page_chunks):
-                embedding = get_embedding(chunk)
-                embeddings.append(embedding)
-                
-                new_index_to_chunk[chunk_counter] = {
-                    "text": chunk,
-                    "document": doc["filename"],
-                    "doc_id": doc["id"],
-                    "chunk_index": chunk_counter,
-                    "page_number": page_num
-                }
-                chunk_counter += 1
-    
-    if embeddings:
-        embeddings_array = np.vstack(embeddings).astype('float32')
-        new_index.add(embeddings_array)
-    
-    metadata["total_chunks"] = len(new_index_to_chunk)
-    
-    # Save new index
-    faiss.write_index(new_index, INDEX_PATH)
-    with open(CHUNK_MAPPING_PATH, "wb") as f:
-        pickle.dump(new_index_to_chunk, f)
-    with open(METADATA_PATH, "wb") as f:
-        pickle.dump(metadata, f)
+            last_checkpoint = time.time()
     
+    with get_write_lock(collection):
+        metadata = get_metadata(collection)
+        
+        # Catch up with deletes and uploads that landed while rebuilding
+        live_ids = {doc["id"] for doc in metadata["documents"]}
+        for doc_id in [doc_id for doc_id in done if doc_id not in live_ids]:
+            new_index, new_index_to_chunk = remove_document_chunks(
+                new_index, new_index_to_chunk, doc_id
+            )
+            del done[doc_id]
+        
+        near_duplicates = NearDuplicateIndex.from_chunks(
+            new_index_to_chunk, config.get("near_duplicate_threshold", 1.0)
+        )
+        for doc in metadata["documents"]:
+            if doc["id"] not in done:
+                _rebuild_document(doc, config, new_index, new_index_to_chunk, near_duplicates, done)
+            doc["indexed_generation"] = metadata.get("generation", 0) + 1
+        
+        update_chunk_counts(metadata, new_index_to_chunk)
+        metadata["total_chunks"] = len(new_index_to_chunk)
+        # The configured settings take effect with the swap
+        metadata["build"] = dict(rebuild_config)
+        save_index(collection, new_index, new_index_to_chunk, metadata)
+        _clear_rebuild_checkpoint(collection)
+    
+    chunk_counter = sum(doc["chunks"] for doc in metadata["documents"])
     return True, f"Reindexed {len(metadata['documents'])} documents with {chunk_counter} chunks"
+
+
+def _rebuild_document(doc, config, index, index_to_chunk, near_duplicates, done):
+    """Re-extract and re-embed one document into an index being rebuilt"""
+    counts = (0, 0)
+    if os.path.exists(doc["path"]):
+        embeddings = []
+        pages_text = extract_text_from_file(doc["path"])
+        counts = _append_document_chunks(
+            pages_text, doc["id"], doc["filename"], config, index_to_chunk, near_duplicates,
+            embeddings
+        )
+        if embeddings:
+            index.add(prepare_vectors(np.vstack(embeddings), index_similarity(index)))
+    done[doc["id"]] = counts
+
+
+def _load_rebuild_checkpoint(collection, rebuild_config):
+    """Resume a rebuild taken with the same settings, or start an empty one"""
+    paths = get_collection_paths(collection)
+    if os.path.exists(paths["rebuild_checkpoint"]) and \
+            os.path.exists(paths["rebuild_checkpoint_index"]):
+        try:
+            with open(paths["rebuild_checkpoint"], "rb") as f:
+                checkpoint = pickle.load(f)
+            index = faiss.read_index(paths["rebuild_checkpoint_index"])
+            if checkpoint["config"] == rebuild_config and \
+                    index.ntotal == len(checkpoint["index_to_chunk"]):
+                return index, checkpoint["index_to_chunk"], checkpoint["done"]
+        except Exception as e:
+            print(f"Discarding unreadable rebuild checkpoint: {e}")
+    
+    index = create_index(rebuild_config.get("dimension", 768),
+                         rebuild_config.get("similarity", "cosine"))
+    return index, {}, {}
+
+
+def _save_rebuild_checkpoint(collection, rebuild_config, index, index_to_chunk, done):
+    paths = get_collection_paths(collection)
+    _write_atomic(paths["rebuild_checkpoint_index"], lambda path: faiss.write_index(index, path))
+    checkpoint = {"config": rebuild_config, "index_to_chunk": index_to_chunk, "done": done}
+    _write_atomic(paths["rebuild_checkpoint"], lambda path: _dump_pickle(checkpoint, path))
+
+
+def _clear_rebuild_checkpoint(collection):
+    paths = get_collection_paths(collection)
+    for key in ("rebuild_checkpoint", "rebuild_checkpoint_index"):
+        if os.path.exists(paths[key]):
+            os.remove(paths[key])
+
+
+def has_rebuild_checkpoint(collection=DEFAULT_COLLECTION):
+    """Whether an interrupted rebuild of the collection can be resumed"""
+    return os.path.exists(get_collection_paths(collection)["rebuild_checkpoint"])
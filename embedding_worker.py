@@ -0,0 +1,423 @@
+import os
+import time
+import secrets
+import argparse
+import threading
+from collections import deque
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+import numpy as np
+
+INTERACTIVE_LANE = "interactive"
+BULK_LANE = "bulk"
+LANES = [INTERACTIVE_LANE, BULK_LANE]
+
+DEFAULT_SOCKET = "embedding_worker.sock"
+# Shared secret for worker connections; without it each worker keeps a random key in <socket>.key
+AUTHKEY_ENV = "CSE_EMBEDDING_AUTHKEY"
+
+# Texts per unit of work; bulk requests are split so interactive ones can run in between
+BULK_SLICE_SIZE = 8
+# Texts a client sends per bulk request, so each one finishes well within the client timeout
+BULK_REQUEST_SIZE = BULK_SLICE_SIZE * 4
+# How often a connection thread checks whether its client went away while waiting
+CANCEL_POLL_SECONDS = 0.5
+# Queued units of work each lane accepts before callers are told to back off
+DEFAULT_LANE_CAPACITY = {INTERACTIVE_LANE: 64, BULK_LANE: 256}
+# Recent request latencies kept per lane for percentiles
+LATENCY_WINDOW = 1000
+
+# Client retry behaviour when the worker reports it is busy
+INTERACTIVE_BUSY_RETRIES = 3
+BUSY_BACKOFF_SECONDS = 0.05
+MAX_BUSY_BACKOFF_SECONDS = 2.0
+
+
+class EmbeddingWorkerUnavailable(Exception):
+    """The embedding worker could not be reached, kept rejecting the request or failed it"""
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    position = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return round(sorted_values[position] * 1000, 2)
+
+
+def load_authkey(socket_path, create=False):
+    """Key that clients of a worker socket authenticate with.
+
+    Connections exchange pickles, so only holders of the key may connect. It
+    comes from CSE_EMBEDDING_AUTHKEY when set, otherwise from a key file beside
+    the socket that is readable by its owner only and that the worker creates
+    with a random key on first start.
+    """
+    if os.environ.get(AUTHKEY_ENV):
+        return os.environ[AUTHKEY_ENV].encode()
+    key_path = f"{socket_path}.key"
+    if create and not os.path.exists(key_path):
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_hex(32))
+    with open(key_path, "rb") as f:
+        return f.read().strip()
+
+
+class LaneScheduler:
+    """Bounded per-lane queues; workers always drain the interactive lane first"""
+
+    def __init__(self, capacity=None):
+        self.capacity = dict(DEFAULT_LANE_CAPACITY, **(capacity or {}))
+        self._queues = {lane: deque() for lane in LANES}
+        self._condition = threading.Condition()
+        self._metrics = {
+            lane: {"requests": 0, "rejected": 0, "cancelled": 0, "errors": 0, "texts": 0,
+                   "latency": deque(maxlen=LATENCY_WINDOW),
+                   "queue_wait": deque(maxlen=LATENCY_WINDOW)}
+            for lane in LANES
+        }
+
+    def submit(self, lane, items):
+        """Queue all items of one request, or none of them if the lane is full"""
+        with self._condition:
+            queue = self._queues[lane]
+            if len(queue) + len(items) > self.capacity[lane] and queue:
+                self._metrics[lane]["rejected"] += 1
+                return False
+            queue.extend(items)
+            self._condition.notify(len(items))
+            return True
+
+    def cancel(self, lane, request):
+        """Drop the queued items of a request whose client went away"""
+        with self._condition:
+            queue = self._queues[lane]
+            self._queues[lane] = deque(item for item in queue if item.request is not request)
+            self._metrics[lane]["cancelled"] += 1
+
+    def take(self):
+        with self._condition:
+            while True:
+                for lane in LANES:
+                    if self._queues[lane]:
+                        return self._queues[lane].popleft()
+                self._condition.wait()
+
+    def record(self, lane, latency, queue_wait, texts, failed=False):
+        with self._condition:
+            metrics = self._metrics[lane]
+            metrics["requests"] += 1
+            metrics["texts"] += texts
+            metrics["errors"] += int(failed)
+            metrics["latency"].append(latency)
+            metrics["queue_wait"].append(queue_wait)
+
+    def stats(self):
+        with self._condition:
+            lanes = {}
+            for lane in LANES:
+                metrics = self._metrics[lane]
+                latency = sorted(metrics["latency"])
+                queue_wait = sorted(metrics["queue_wait"])
+                lanes[lane] = {
+                    "queued": len(self._queues[lane]),
+                    "capacity": self.capacity[lane],
+                    "requests": metrics["requests"],
+                    "texts": metrics["texts"],
+                    "rejected": metrics["rejected"],
+                    "cancelled": metrics["cancelled"],
+                    "errors": metrics["errors"],
+                    "latency_ms": {"p50": _percentile(latency, 0.5),
+                                   "p95": _percentile(latency, 0.95),
+                                   "max": _percentile(latency, 1.0)},
+                    "queue_wait_ms": {"p50": _percentile(queue_wait, 0.5),
+                                      "p95": _percentile(queue_wait, 0.95)}
+                }
+            return {"lanes": lanes}
+
+
+class _WorkItem:
+    """A slice of one request's texts, filled in by an inference thread"""
+
+    def __init__(self, texts, model_name, pooling, request):
+        self.texts = texts
+        self.model_name = model_name
+        self.pooling = pooling
+        self.request = request
+        self.started = None
+        self.vectors = None
+        self.error = None
+
+
+class _PendingRequest:
+    def __init__(self, slices):
+        self.remaining = slices
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def finish_slice(self):
+        with self._lock:
+            self.remaining -= 1
+            if self.remaining == 0:
+                self.done.set()
+
+
+class EmbeddingWorker:
+    """Embedding server: connection threads queue work, inference threads run the model"""
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, threads=1, capacity=None, authkey=None):
+        self.socket_path = socket_path
+        self.threads = threads
+        self.authkey = authkey
+        self.scheduler = LaneScheduler(capacity)
+        self.started_at = time.time()
+
+    def _embed(self, texts, model_name, pooling):
+        # Imported here so clients of this module do not pull in the model stack
+        import document_processor
+        if len(texts) > 1 and pooling == 'mean':
+            return document_processor.get_embeddings(texts, model_name, batch_size=len(texts))
+        return np.vstack([
+            document_processor.compute_embedding(text, pooling, model_name) for text in texts
+        ])
+
+    def _inference_loop(self):
+        while True:
+            item = self.scheduler.take()
+            item.started = time.monotonic()
+            try:
+                item.vectors = self._embed(item.texts, item.model_name, item.pooling)
+            except Exception as e:
+                item.error = str(e)
+            item.request.finish_slice()
+
+    def handle_embed(self, message, connection):
+        lane = message.get("lane", INTERACTIVE_LANE)
+        if lane not in LANES:
+            return {"error": f"Unknown lane {lane}"}
+        texts = list(message["texts"])
+        if not texts:
+            return {"vectors": np.zeros((0, 0), dtype='float32')}
+
+        slice_size = BULK_SLICE_SIZE if lane == BULK_LANE else len(texts)
+        slices = [texts[i:i + slice_size] for i in range(0, len(texts), slice_size)]
+        request = _PendingRequest(len(slices))
+        items = [
+            _WorkItem(chunk, message.get("model"), message.get("pooling", "mean"), request)
+            for chunk in slices
+        ]
+
+        submitted = time.monotonic()
+        if not self.scheduler.submit(lane, items):
+            return {"error": "busy"}
+        while not request.done.wait(CANCEL_POLL_SECONDS):
+            if connection.poll():
+                # The client timed out or exited; nobody will read the result
+                self.scheduler.cancel(lane, request)
+                return None
+
+        errors = [item.error for item in items if item.error]
+        queue_wait = items[0].started - submitted
+        self.scheduler.record(lane, time.monotonic() - submitted, queue_wait, len(texts),
+                              failed=bool(errors))
+        if errors:
+            return {"error": errors[0]}
+        return {"vectors": np.vstack([item.vectors for item in items]).astype('float32')}
+
+    def stats(self):
+        import document_processor
+        stats = self.scheduler.stats()
+        stats.update(pid=os.getpid(), threads=self.threads,
+                     uptime_seconds=round(time.time() - self.started_at, 1),
+                     models=document_processor.model_manager.stats())
+        return stats
+
+    def _serve_connection(self, connection):
+        with connection:
+            while True:
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    return
+                op = message.get("op")
+                if op == "embed":
+                    response = self.handle_embed(message, connection)
+                elif op == "stats":
+                    response = self.stats()
+                elif op == "ping":
+                    response = {"ok": True}
+                else:
+                    response = {"error": f"Unknown operation {op}"}
+                if response is None:
+                    return
+                try:
+                    connection.send(response)
+                except (EOFError, OSError):
+                    return
+
+    def serve_forever(self, preload=()):
+        if preload:
+            import document_processor
+            document_processor.model_manager.preload(preload)
+
+        for _ in range(self.threads):
+            threading.Thread(target=self._inference_loop, daemon=True).start()
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        # Create the key file and socket owner-only from the start, not chmodded after bind
+        previous_umask = os.umask(0o077)
+        try:
+            authkey = self.authkey or load_authkey(self.socket_path, create=True)
+            listener = Listener(self.socket_path, family="AF_UNIX", authkey=authkey)
+        finally:
+            os.umask(previous_umask)
+        with listener:
+            print(f"Embedding worker {os.getpid()} listening on {self.socket_path} "
+                  f"with {self.threads} threads")
+            while True:
+                try:
+                    connection = listener.accept()
+                except Exception as e:
+                    print(f"Rejected embedding worker connection: {e}")
+                    continue
+                threading.Thread(
+                    target=self._serve_connection, args=(connection,), daemon=True
+                ).start()
+
+
+class EmbeddingClient:
+    """Client for one or more embedding workers, keeping a connection per thread and socket.
+
+    Requests go to the sockets round-robin. Interactive requests that find a
+    worker busy are retried briefly and then reported as unavailable so the
+    caller can embed in-process; bulk requests wait with growing backoff,
+    which throttles ingestion instead of the worker queue growing. Bulk texts
+    are sent BULK_REQUEST_SIZE at a time so no single request outlasts the timeout.
+    """
+
+    def __init__(self, socket_paths, authkey=None, timeout=30):
+        if isinstance(socket_paths, str):
+            socket_paths = [path for path in socket_paths.split(",") if path]
+        self.socket_paths = list(socket_paths)
+        self.authkey = authkey
+        self.timeout = timeout
+        self._local = threading.local()
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def _connection(self, socket_path):
+        connections = self._local.__dict__.setdefault("connections", {})
+        connection = connections.get(socket_path)
+        if connection is None:
+            try:
+                authkey = self.authkey or load_authkey(socket_path)
+                connection = Client(socket_path, family="AF_UNIX", authkey=authkey)
+            except (OSError, EOFError, AuthenticationError) as e:
+                raise EmbeddingWorkerUnavailable(
+                    f"Cannot connect to embedding worker at {socket_path}: {e}"
+                )
+            connections[socket_path] = connection
+        return connection
+
+    def _request(self, socket_path, message):
+        connection = self._connection(socket_path)
+        try:
+            connection.send(message)
+            if not connection.poll(self.timeout):
+                raise EmbeddingWorkerUnavailable(f"Embedding worker at {socket_path} timed out")
+            return connection.recv()
+        except (OSError, EOFError, EmbeddingWorkerUnavailable) as e:
+            # The connection is in an unknown state; reconnect on the next request
+            connection.close()
+            del self._local.connections[socket_path]
+            if isinstance(e, EmbeddingWorkerUnavailable):
+                raise
+            raise EmbeddingWorkerUnavailable(
+                f"Lost connection to embedding worker at {socket_path}: {e}"
+            )
+
+    def _pick_socket(self):
+        with self._lock:
+            socket_path = self.socket_paths[self._next % len(self.socket_paths)]
+            self._next += 1
+        return socket_path
+
+    def embed(self, texts, model_name, lane=INTERACTIVE_LANE, pooling='mean'):
+        """Embed texts in a worker; returns a (len(texts), dimension) float32 array"""
+        texts = list(texts)
+        if lane != BULK_LANE or len(texts) <= BULK_REQUEST_SIZE:
+            return self._embed_request(texts, model_name, lane, pooling)
+        return np.vstack([
+            self._embed_request(texts[i:i + BULK_REQUEST_SIZE], model_name, lane, pooling)
+            for i in range(0, len(texts), BULK_REQUEST_SIZE)
+        ])
+
+    def _embed_request(self, texts, model_name, lane, pooling):
+        message = {"op": "embed", "texts": texts, "model": model_name, "lane": lane,
+                   "pooling": pooling}
+        backoff = BUSY_BACKOFF_SECONDS
+        attempts = 0
+        while True:
+            response = self._request(self._pick_socket(), message)
+            if response.get("error") != "busy":
+                break
+            attempts += 1
+            if lane == INTERACTIVE_LANE and attempts > INTERACTIVE_BUSY_RETRIES:
+                raise EmbeddingWorkerUnavailable("Embedding workers are busy")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BUSY_BACKOFF_SECONDS)
+
+        if "error" in response:
+            # Callers fall back to embedding in-process, as for an unreachable worker
+            raise EmbeddingWorkerUnavailable(f"Embedding worker failed: {response['error']}")
+        return response["vectors"]
+
+    def stats(self):
+        """Per-worker lane statistics keyed by socket path"""
+        workers = {}
+        for socket_path in self.socket_paths:
+            try:
+                workers[socket_path] = self._request(socket_path, {"op": "stats"})
+            except EmbeddingWorkerUnavailable as e:
+                workers[socket_path] = {"error": str(e)}
+        return workers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local embedding worker on a Unix socket.")
+    parser.add_argument("--socket",
+                        default=os.environ.get("CSE_EMBEDDING_SOCKET") or DEFAULT_SOCKET,
+                        help="Unix socket path to listen on")
+    parser.add_argument("--threads", type=int, default=1, help="Inference threads")
+    parser.add_argument("--torch-threads", type=int, default=None,
+                        help="Threads torch uses per operation")
+    parser.add_argument("--interactive-capacity", type=int,
+                        default=DEFAULT_LANE_CAPACITY[INTERACTIVE_LANE],
+                        help="Queued interactive requests before callers are told to back off")
+    parser.add_argument("--bulk-capacity", type=int, default=DEFAULT_LANE_CAPACITY[BULK_LANE],
+                        help=f"Queued bulk slices of {BULK_SLICE_SIZE} texts before callers "
+                             f"are told to back off")
+    parser.add_argument("--preload", nargs="*", default=None,
+                        help="Models to load before serving (default: the configured model)")
+    args = parser.parse_args()
+
+    if args.torch_threads:
+        import torch
+        torch.set_num_threads(args.torch_threads)
+
+    preload = args.preload
+    if preload is None:
+        from config import load_config
+        preload = [load_config().get("model_repo_id", "distilbert-base-uncased")]
+
+    worker = EmbeddingWorker(
+        args.socket, args.threads,
+        {INTERACTIVE_LANE: args.interactive_capacity, BULK_LANE: args.bulk_capacity}
+    )
+    worker.serve_forever(preload)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+import os
+
+# Load models and indexes once in the master before forking, so every worker
+# shares the same weights and index pages copy-on-write
+os.environ.setdefault("CSE_PRELOAD", "1")
+preload_app = True
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "4"))
+threads = int(os.environ.get("THREADS", "4"))
+timeout = 120
+
+
+def post_fork(server, worker):
+    # Resume interrupted rebuilds in the workers, never in the master (see app.py);
+    # the rebuild lock lets only one worker pick up each collection
+    from rebuild_jobs import resume_pending_rebuilds
+    resume_pending_rebuilds()
@@ -0,0 +1,120 @@
+import time
+import threading
+from collections import OrderedDict
+from transformers import AutoTokenizer, AutoModel
+
+DEFAULT_MODEL = "distilbert-base-uncased"
+
+
+def estimate_model_memory(model):
+    """Bytes held by a model's parameters and buffers"""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+class ModelManager:
+    """Keeps loaded models within a memory budget, evicting the least recently used"""
+
+    def __init__(self, budget_mb=2048):
+        self.budget_mb = budget_mb
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per model name so a slow load only blocks callers of that model
+        self._load_locks = {}
+
+    def get(self, model_name):
+        """Get (tokenizer, model), loading the model and evicting others if needed"""
+        with self._lock:
+            entry = self._touch(model_name)
+            if entry is not None:
+                return entry["tokenizer"], entry["model"]
+            load_lock = self._load_locks.setdefault(model_name, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                # Another thread may have finished loading it while we waited
+                entry = self._touch(model_name)
+                if entry is not None:
+                    return entry["tokenizer"], entry["model"]
+
+            # Loading can mean a download, so it runs without holding the manager lock
+            entry = self._load(model_name)
+
+            with self._lock:
+                entry = self._models.setdefault(entry["name"], entry)
+                self._touch(entry["name"])
+                self._evict(keep=entry["name"])
+                return entry["tokenizer"], entry["model"]
+
+    def _touch(self, model_name):
+        """Mark a loaded model as most recently used; call with the lock held"""
+        entry = self._models.get(model_name)
+        if entry is not None:
+            self._models.move_to_end(model_name)
+            entry["last_used"] = time.time()
+        return entry
+
+    def _load(self, model_name):
+        try:
+            tokenizer = AutoTokenizer.from_pretrained(model_name)
+            model = AutoModel.from_pretrained(model_name)
+        except Exception as e:
+            print(f"Error loading model {model_name}: {e}")
+            # Fallback to default
+            if model_name == DEFAULT_MODEL:
+                raise
+            model_name = DEFAULT_MODEL
+            with self._lock:
+                entry = self._models.get(model_name)
+            if entry is not None:
+                return entry
+            tokenizer = AutoTokenizer.from_pretrained(model_name)
+            model = AutoModel.from_pretrained(model_name)
+
+        model.eval()
+        return {
+            "name": model_name,
+            "tokenizer": tokenizer,
+            "model": model,
+            "memory_bytes": estimate_model_memory(model),
+            "loaded_at": time.time(),
+            "last_used": time.time()
+        }
+
+    def _evict(self, keep=None):
+        """Drop least recently used models until the rest fit the budget"""
+        budget_bytes = self.budget_mb * 1024 * 1024
+        for name in list(self._models):
+            if self._used_bytes() <= budget_bytes:
+                break
+            if name != keep:
+                del self._models[name]
+
+    def _used_bytes(self):
+        return sum(entry["memory_bytes"] for entry in self._models.values())
+
+    def configure(self, budget_mb):
+        with self._lock:
+            self.budget_mb = budget_mb
+            self._evict(keep=next(reversed(self._models), None))
+
+    def preload(self, model_names):
+        """Load models up front, e.g. in a server master process before it forks workers"""
+        for model_name in model_names:
+            self.get(model_name)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "budget_mb": self.budget_mb,
+                "used_mb": round(self._used_bytes() / (1024 * 1024), 1),
+                "models": [
+                    {
+                        "name": name,
+                        "memory_mb": round(entry["memory_bytes"] / (1024 * 1024), 1),
+                        "loaded_at": entry["loaded_at"],
+                        "last_used": entry["last_used"]
+                    }
+                    for name, entry in reversed(self._models.items())
+                ]
+            }
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import fcntl
+import threading
+from datetime import datetime
+from document_processor import rebuild_index_with_new_config, has_rebuild_checkpoint
+from collection_manager import (
+    DEFAULT_COLLECTION,
+    collection_exists,
+    get_collection_paths,
+    list_collections
+)
+
+# Open lock files of the rebuilds running in this process
+_lock_files = {}
+_lock_files_guard = threading.Lock()
+
+
+def _acquire_process_lock(collection):
+    """Claim a collection's rebuild across processes (e.g. several app workers).
+
+    The lock is an flock on the lock file, so the kernel drops it when the
+    holder exits and a leftover file never blocks later rebuilds.
+    """
+    with _lock_files_guard:
+        if collection in _lock_files:
+            return False
+        lock_file = open(get_collection_paths(collection)["rebuild_lock"], "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        _lock_files[collection] = lock_file
+        return True
+
+
+def _release_process_lock(collection):
+    with _lock_files_guard:
+        lock_file = _lock_files.pop(collection, None)
+    if lock_file is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+
+def _rebuild_locked(collection):
+    """Whether any process is running a rebuild of the collection"""
+    if collection in _lock_files:
+        return True
+    lock_path = get_collection_paths(collection)["rebuild_lock"]
+    if not os.path.exists(lock_path):
+        return False
+    with open(lock_path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return False
+
+
+def _save_status(collection, job):
+    """Persist job progress where every app worker can read it"""
+    status_path = get_collection_paths(collection)["rebuild_status"]
+    tmp_path = f"{status_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(job, f)
+    os.replace(tmp_path, status_path)
+
+
+def get_rebuild_status(collection=DEFAULT_COLLECTION):
+    """Get the latest rebuild job of a collection, or None"""
+    status_path = get_collection_paths(collection)["rebuild_status"]
+    if not collection_exists(collection) or not os.path.exists(status_path):
+        return None
+    try:
+        with open(status_path) as f:
+            job = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if job["status"] in ("queued", "running") and not _rebuild_locked(collection):
+        # The process running it exited; it resumes from its checkpoint on restart
+        job["status"] = "interrupted"
+        job["eta_seconds"] = None
+    return job
+
+
+def is_rebuilding(collection=DEFAULT_COLLECTION):
+    job = get_rebuild_status(collection)
+    return bool(job) and job["status"] in ("queued", "running")
+
+
+def start_rebuild(collection=DEFAULT_COLLECTION):
+    """Start a background rebuild, returning (started, job)"""
+    if not _acquire_process_lock(collection):
+        job = get_rebuild_status(collection) or {"collection": collection, "status": "running"}
+        job["message"] = "A rebuild is already running"
+        return False, job
+
+    job = {
+        "collection": collection,
+        "status": "queued",
+        "resumed": has_rebuild_checkpoint(collection),
+        "pid": os.getpid(),
+        "started_at": datetime.now().isoformat(),
+        "finished_at": None,
+        "processed_documents": 0,
+        "total_documents": 0,
+        "progress": 0.0,
+        "eta_seconds": None,
+        "message": None
+    }
+    _save_status(collection, job)
+
+    thread = threading.Thread(target=_run_rebuild, args=(collection, job), daemon=True)
+    thread.start()
+    return True, dict(job)
+
+
+def _run_rebuild(collection, job):
+    started = time.time()
+    start_bytes = []
+
+    def progress(processed_documents, total_documents, processed_bytes, total_bytes):
+        # ETA from the throughput of this run, ignoring work restored from a checkpoint
+        if not start_bytes:
+            start_bytes.append(processed_bytes)
+        elapsed = time.time() - started
+        done_this_run = processed_bytes - start_bytes[0]
+        remaining = total_bytes - processed_bytes
+        job["processed_documents"] = processed_documents
+        job["total_documents"] = total_documents
+        job["progress"] = processed_bytes / total_bytes if total_bytes else 1.0
+        job["eta_seconds"] = None
+        if done_this_run > 0:
+            job["eta_seconds"] = round(elapsed / done_this_run * remaining, 1)
+        _save_status(collection, job)
+
+    job["status"] = "running"
+    _save_status(collection, job)
+
+    try:
+        success, message = rebuild_index_with_new_config(collection, progress=progress)
+        status = "completed" if success else "failed"
+    except Exception as e:
+        print(f"Error rebuilding collection {collection}: {e}")
+        status, message = "failed", str(e)
+
+    job["status"] = status
+    job["message"] = message
+    job["finished_at"] = datetime.now().isoformat()
+    job["eta_seconds"] = 0 if status == "completed" else None
+    if status == "completed":
+        job["progress"] = 1.0
+    try:
+        _save_status(collection, job)
+    finally:
+        _release_process_lock(collection)
+
+
+def resume_pending_rebuilds():
+    """Restart rebuilds that were interrupted by a process exit"""
+    for collection in list_collections():
+        if has_rebuild_checkpoint(collection):
+            start_rebuild(collection)
@@ -0,0 +1,105 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe LRU cache bounded by entry count and entry age"""
+
+    def __init__(self, max_entries=1024, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached value, or None on a miss or an expired entry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (self.ttl_seconds and
+                                 time.monotonic() - entry[0] > self.ttl_seconds):
+                if entry is not None:
+                    del self._entries[key]
+                    self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard_where(self, predicate):
+        """Drop every entry whose key matches the predicate"""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+                self.evictions += 1
+
+    def configure(self, max_entries, ttl_seconds):
+        with self._lock:
+            self.max_entries = max_entries
+            self.ttl_seconds = ttl_seconds
+            while len(self._entries) > max(max_entries, 0):
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+# Query embeddings keyed by (model, query text)
+query_embedding_cache = TTLCache()
+# Search results keyed by (normalized query,
+# (collection, index version, search settings) per collection, sort_by, k, min_score)
+search_result_cache = TTLCache()
+
+
+def configure_caches(config):
+    """Apply cache sizes and TTLs from the configuration"""
+    ttl = config.get("search_cache_ttl", 300)
+    query_embedding_cache.configure(config.get("query_embedding_cache_size", 1024), ttl)
+    search_result_cache.configure(config.get("search_cache_size", 512), ttl)
+
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
+
+
+def invalidate_collection(collection):
+    """Forget cached results that involve a collection whose index changed"""
+    search_result_cache.discard_where(
+        lambda key: any(entry[0] == collection for entry in key[1])
+    )
+
+
+def get_cache_stats():
+    return {
+        "query_embeddings": query_embedding_cache.stats(),
+        "results": search_result_cache.stats()
+    }
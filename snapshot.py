@@ -0,0 +1,317 @@
+import os
+import json
+import hashlib
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+from dedup import NUM_PERMUTATIONS
+from collection_manager import (
+    DEFAULT_COLLECTION,
+    COLLECTION_CONFIG_KEYS,
+    collection_exists,
+    create_collection,
+    save_collection_config,
+    get_write_lock
+)
+import document_processor
+
+SNAPSHOT_FORMAT = "context-search-snapshot"
+SNAPSHOT_VERSION = 2
+VECTOR_DTYPES = ("float32", "float16", "int8")
+MANIFEST_FILE = "manifest.json"
+
+# Chunk fields stored in their own arrays rather than in chunks.jsonl
+_ARRAY_FIELDS = ("text", "minhash")
+
+
+def _sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def _encode_vectors(vectors, dtype):
+    """Compress vectors; int8 uses a symmetric scale per dimension"""
+    if dtype == "float32":
+        return {"vectors.npy": vectors.astype(np.float32)}
+    if dtype == "float16":
+        return {"vectors.npy": vectors.astype(np.float16)}
+
+    scale = np.abs(vectors).max(axis=0) / 127.0 if len(vectors) else np.ones(vectors.shape[1])
+    scale = np.where(scale == 0, 1.0, scale).astype(np.float32)
+    quantized = np.clip(np.rint(vectors / scale), -127, 127).astype(np.int8)
+    return {"vectors.npy": quantized, "vector_scale.npy": scale}
+
+
+def _decode_vectors(snapshot_dir, dtype):
+    vectors = np.load(os.path.join(snapshot_dir, "vectors.npy"), mmap_mode="r")
+    if dtype == "int8":
+        scale = np.load(os.path.join(snapshot_dir, "vector_scale.npy"))
+        return vectors.astype(np.float32) * scale
+    return np.ascontiguousarray(vectors, dtype=np.float32)
+
+
+def _select_segments(index_to_chunk, metadata, since_generation):
+    """Pick the chunk rows and references to ship.
+
+    A full snapshot ships every chunk. An incremental one ships the segments
+    (documents) indexed after `since_generation`, plus references those
+    documents added to chunks owned by older segments.
+    """
+    if since_generation is None:
+        return list(index_to_chunk), [], {doc["id"] for doc in metadata["documents"]}
+
+    changed = {doc["id"] for doc in metadata["documents"]
+               if doc.get("indexed_generation", 0) > since_generation}
+    rows, references = [], []
+    for idx, chunk_data in index_to_chunk.items():
+        if chunk_data.get("doc_id") in changed:
+            rows.append(idx)
+            continue
+        for ref in chunk_data.get("duplicates", []):
+            if ref["doc_id"] in changed:
+                references.append({
+                    "owner": [chunk_data["doc_id"], chunk_data["chunk_index"]],
+                    "ref": ref
+                })
+    return rows, references, changed
+
+
+def export_snapshot(output_dir, collection=DEFAULT_COLLECTION, dtype="float16",
+                    since_generation=None):
+    """Write a versioned, checksummed snapshot of a collection's live generation.
+
+    Vectors, chunk text offsets and MinHash signatures are plain .npy arrays
+    that can be memory-mapped; chunk text is one UTF-8 blob. Passing
+    `since_generation` writes an incremental snapshot holding only the
+    segments indexed after that generation plus the list of live documents,
+    so deletions carry over as well.
+    """
+    if dtype not in VECTOR_DTYPES:
+        return False, f"Unsupported vector dtype {dtype}"
+
+    index, index_to_chunk, metadata = document_processor.load_index_generation(collection)
+    if index is None:
+        return False, "No index found"
+
+    generation = metadata.get("generation", 0)
+    if since_generation is not None and since_generation >= generation:
+        return False, f"Collection is still at generation {generation}"
+
+    rows, references, segment_ids = _select_segments(index_to_chunk, metadata, since_generation)
+    os.makedirs(output_dir, exist_ok=True)
+
+    if index.ntotal:
+        all_vectors = index.reconstruct_n(0, index.ntotal)
+    else:
+        all_vectors = np.zeros((0, index.d), np.float32)
+    arrays = _encode_vectors(all_vectors[rows], dtype)
+
+    texts = [index_to_chunk[idx]["text"].encode("utf-8") for idx in rows]
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(text) for text in texts])
+    arrays["chunk_offsets.npy"] = offsets
+
+    signatures = np.zeros((len(rows), NUM_PERMUTATIONS), dtype=np.uint32)
+    for row, idx in enumerate(rows):
+        if index_to_chunk[idx].get("minhash") is not None:
+            signatures[row] = index_to_chunk[idx]["minhash"]
+    arrays["minhash.npy"] = signatures
+
+    for name, array in arrays.items():
+        np.save(os.path.join(output_dir, name), array)
+    with open(os.path.join(output_dir, "chunk_text.bin"), "wb") as f:
+        for text in texts:
+            f.write(text)
+    with open(os.path.join(output_dir, "chunks.jsonl"), "w", encoding="utf-8") as f:
+        for idx in rows:
+            chunk_data = index_to_chunk[idx]
+            record = {key: value for key, value in chunk_data.items() if key not in _ARRAY_FIELDS}
+            record["has_minhash"] = chunk_data.get("minhash") is not None
+            f.write(json.dumps(record) + "\n")
+    with open(os.path.join(output_dir, "catalog.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "documents": [doc for doc in metadata["documents"] if doc["id"] in segment_ids],
+            "live_documents": [doc["id"] for doc in metadata["documents"]],
+            "references": references
+        }, f)
+
+    config = document_processor.get_build_config(collection, metadata)
+    files = sorted(name for name in os.listdir(output_dir) if name != MANIFEST_FILE)
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "collection": collection,
+        "generation": generation,
+        "base_generation": since_generation,
+        "created_on": datetime.now().isoformat(),
+        "config": {key: config.get(key) for key in COLLECTION_CONFIG_KEYS},
+        "dimension": index.d,
+        "similarity": document_processor.index_similarity(index),
+        "vector_dtype": dtype,
+        "num_chunks": len(rows),
+        "files": {
+            name: {"sha256": _sha256(os.path.join(output_dir, name)),
+                   "bytes": os.path.getsize(os.path.join(output_dir, name))}
+            for name in files
+        }
+    }
+    with open(os.path.join(output_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    kind = "incremental" if since_generation is not None else "full"
+    return True, f"Exported {kind} snapshot of generation {generation} with {len(rows)} chunks"
+
+
+def load_snapshot(snapshot_dir, verify=True):
+    """Read and verify a snapshot; returns (manifest, vectors, chunks, catalog)"""
+    with open(os.path.join(snapshot_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != SNAPSHOT_FORMAT or manifest.get("version", 0) > SNAPSHOT_VERSION:
+        raise ValueError("Unsupported snapshot format")
+    # Version 1 snapshots predate similarity modes and hold L2 vectors
+    manifest.setdefault("similarity", "l2")
+
+    if verify:
+        for name, info in manifest["files"].items():
+            if _sha256(os.path.join(snapshot_dir, name)) != info["sha256"]:
+                raise ValueError(f"Checksum mismatch in {name}")
+
+    vectors = _decode_vectors(snapshot_dir, manifest["vector_dtype"])
+    offsets = np.load(os.path.join(snapshot_dir, "chunk_offsets.npy"), mmap_mode="r")
+    signatures = np.load(os.path.join(snapshot_dir, "minhash.npy"), mmap_mode="r")
+    with open(os.path.join(snapshot_dir, "chunk_text.bin"), "rb") as f:
+        blob = f.read()
+
+    chunks = []
+    with open(os.path.join(snapshot_dir, "chunks.jsonl"), encoding="utf-8") as f:
+        for row, line in enumerate(f):
+            chunk_data = json.loads(line)
+            has_minhash = chunk_data.pop("has_minhash")
+            chunk_data["text"] = blob[offsets[row]:offsets[row + 1]].decode("utf-8")
+            chunk_data["minhash"] = np.array(signatures[row]) if has_minhash else None
+            chunks.append(chunk_data)
+
+    with open(os.path.join(snapshot_dir, "catalog.json"), encoding="utf-8") as f:
+        catalog = json.load(f)
+    return manifest, vectors, chunks, catalog
+
+
+def _apply_snapshot_config(collection, manifest):
+    """Adopt the snapshot's settings and return the build settings of the imported generation.
+
+    The default collection has no config of its own and is never allowed to
+    rewrite the global config; it is served with the recorded build settings.
+    """
+    config = dict(manifest["config"], dimension=manifest["dimension"],
+                  similarity=manifest["similarity"])
+    if collection != DEFAULT_COLLECTION:
+        save_collection_config(collection, config)
+    return {key: config.get(key) for key in document_processor.BUILD_CONFIG_KEYS}
+
+
+def import_snapshot(snapshot_dir, collection=None, verify=True):
+    """Restore a snapshot into a collection and swap it in as the live generation.
+
+    A full snapshot replaces the collection. An incremental snapshot needs the
+    collection to hold a snapshot at least as new as its base generation; its
+    segments replace same-named documents and documents no longer live are
+    removed.
+    """
+    manifest, vectors, chunks, catalog = load_snapshot(snapshot_dir, verify)
+    collection = collection or manifest["collection"]
+    incremental = manifest["base_generation"] is not None
+    if not incremental and not collection_exists(collection):
+        # The collection's write lock lives in its directory
+        create_collection(collection)
+
+    with get_write_lock(collection):
+        if incremental:
+            if not collection_exists(collection):
+                return False, f"Collection {collection} does not exist"
+            index, index_to_chunk, metadata = \
+                document_processor.initialize_or_load_index(collection)
+            if metadata.get("snapshot_generation", -1) < manifest["base_generation"]:
+                return False, (f"Incremental snapshot needs generation "
+                               f"{manifest['base_generation']}, "
+                               f"collection has {metadata.get('snapshot_generation')}")
+            if document_processor.index_similarity(index) != manifest["similarity"]:
+                return False, f"Incremental snapshot uses {manifest['similarity']} similarity"
+        else:
+            build_config = _apply_snapshot_config(collection, manifest)
+            index = document_processor.create_index(manifest["dimension"], manifest["similarity"])
+            index_to_chunk = {}
+            metadata = document_processor.get_metadata(collection)
+            metadata["documents"] = []
+            metadata["build"] = build_config
+
+        # Drop documents that were deleted or are shipped again in this snapshot
+        live_ids = set(catalog["live_documents"])
+        shipped_ids = {doc["id"] for doc in catalog["documents"]}
+        for doc in list(metadata["documents"]):
+            if doc["id"] not in live_ids or doc["id"] in shipped_ids:
+                index, index_to_chunk = document_processor.remove_document_chunks(
+                    index, index_to_chunk, doc["id"]
+                )
+                metadata["documents"].remove(doc)
+
+        for chunk_data in chunks:
+            index_to_chunk[len(index_to_chunk)] = chunk_data
+        if len(vectors):
+            # Renormalizing undoes the drift of float16 and int8 vectors for cosine similarity
+            index.add(document_processor.prepare_vectors(vectors, manifest["similarity"]))
+
+        owners = {(chunk_data["doc_id"], chunk_data["chunk_index"]): chunk_data
+                  for chunk_data in index_to_chunk.values()}
+        for reference in catalog["references"]:
+            owner = owners.get(tuple(reference["owner"]))
+            if owner is not None:
+                owner.setdefault("duplicates", []).append(reference["ref"])
+
+        # Source files stay on the exporting node
+        metadata["documents"] += [dict(doc, external=True) for doc in catalog["documents"]]
+        document_processor.update_chunk_counts(metadata, index_to_chunk)
+        metadata["total_chunks"] = len(index_to_chunk)
+        metadata["snapshot_generation"] = manifest["generation"]
+        document_processor.save_index(collection, index, index_to_chunk, metadata)
+
+    kind = "incremental" if incremental else "full"
+    generation = manifest["generation"]
+    return True, f"Imported {kind} snapshot of generation {generation} into {collection}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import portable index snapshots.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Write a snapshot of a collection")
+    export_parser.add_argument("output", help="Directory to write the snapshot to")
+    export_parser.add_argument("--collection", default=DEFAULT_COLLECTION)
+    export_parser.add_argument("--dtype", choices=VECTOR_DTYPES, default="float16")
+    export_parser.add_argument("--since-generation", type=int, default=None,
+                               help="Only ship segments indexed after this generation")
+
+    import_parser = subparsers.add_parser("import", help="Restore a snapshot into a collection")
+    import_parser.add_argument("snapshot", help="Snapshot directory")
+    import_parser.add_argument("--collection", default=None,
+                               help="Defaults to the exported collection")
+    import_parser.add_argument("--no-verify", action="store_true",
+                               help="Skip checksum verification")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        success, message = export_snapshot(
+            args.output, args.collection, args.dtype, args.since_generation
+        )
+    else:
+        success, message = import_snapshot(args.snapshot, args.collection, not args.no_verify)
+    print(message)
+    raise SystemExit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import io
+import os
+import uuid
+import codecs
+import hashlib
+from flask import Request
+from werkzeug.utils import secure_filename
+from collection_manager import DEFAULT_COLLECTION, UPLOAD_BASE_DIR, collection_exists
+from document_processor import get_build_config
+
+INCOMING_DIR = os.path.join(UPLOAD_BASE_DIR, ".incoming")
+
+
+class StreamingChunker:
+    """Splits text into overlapping word chunks as it arrives, matching chunk_text"""
+
+    def __init__(self, chunk_size=500, overlap=50):
+        self.chunk_size = chunk_size
+        self.step = max(chunk_size - overlap, 1)
+        self.chunks = []
+        self._words = []
+        self._partial = ""
+
+    def feed(self, text):
+        if not text:
+            return
+        words = (self._partial + text).split()
+        # A word cut off at the end of this piece continues in the next one
+        self._partial = words.pop() if words and not text[-1].isspace() else ""
+        self._words.extend(words)
+        while len(self._words) >= self.chunk_size:
+            self.chunks.append(" ".join(self._words[:self.chunk_size]))
+            self._words = self._words[self.step:]
+
+    def close(self):
+        if self._partial:
+            self._words.append(self._partial)
+            self._partial = ""
+        for i in range(0, len(self._words), self.step):
+            self.chunks.append(" ".join(self._words[i:i + self.chunk_size]))
+        self._words = []
+        return self.chunks
+
+
+class UploadSink(io.FileIO):
+    """Upload file that hashes, measures and (for text) chunks data while it is written"""
+
+    def __init__(self, path, chunker=None, collection=DEFAULT_COLLECTION):
+        super().__init__(path, "w+")
+        self.path = path
+        self.collection = collection
+        self.size = 0
+        self._hasher = hashlib.sha256()
+        self._chunker = chunker
+        self._decoder = codecs.getincrementaldecoder("utf-8")() if chunker else None
+
+    def write(self, data):
+        self._hasher.update(data)
+        self.size += len(data)
+        if self._chunker is not None:
+            try:
+                self._chunker.feed(self._decoder.decode(data))
+            except UnicodeDecodeError:
+                # Not valid UTF-8; leave extraction to the regular reader
+                self._chunker = None
+        return super().write(data)
+
+    def hexdigest(self):
+        return self._hasher.hexdigest()
+
+    def pages(self):
+        """Extracted pages ready for indexing, or None if the content was not streamed"""
+        if self._chunker is None:
+            return None
+        try:
+            self._chunker.feed(self._decoder.decode(b"", final=True))
+        except UnicodeDecodeError:
+            return None
+        return [{"page_number": 1, "chunks": self._chunker.close()}]
+
+
+class StreamingRequest(Request):
+    """Request that streams uploaded files straight to disk instead of a spooled temp file.
+
+    Each file lands in uploads/.incoming/ and is moved into place by the view,
+    so the body is read exactly once. Plain text is chunked while it arrives
+    using the chunking settings of the collection named in the query string;
+    PDF and DOCX need the complete file and are extracted after the upload.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_sinks = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        os.makedirs(INCOMING_DIR, exist_ok=True)
+        name = secure_filename(filename or "") or "upload"
+        path = os.path.join(INCOMING_DIR, f"{uuid.uuid4().hex}_{name}")
+
+        collection = self.args.get("collection") or DEFAULT_COLLECTION
+        chunker = None
+        if name.lower().endswith(".txt") and collection_exists(collection):
+            config = get_build_config(collection)
+            chunker = StreamingChunker(
+                config.get("chunk_size", 500), config.get("chunk_overlap", 50)
+            )
+
+        sink = UploadSink(path, chunker, collection)
+        self.upload_sinks.append(sink)
+        return sink
+
+
+def discard_incoming(sinks):
+    """Remove staged upload files that were not moved into place"""
+    for sink in sinks:
+        if not sink.closed:
+            sink.close()
+        if os.path.exists(sink.path):
+            os.remove(sink.path)